@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import signal
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.request
+from urllib.error import URLError
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.synthetic import write_activities  # noqa
+from runnerdash.db import RunnerDB  # noqa
+from runnerdash.config import cfg  # noqa
+
+DB_FILE = 'runnerdash.sqlite'
+PATHS = ('/api/activities', '/api/activities/1/speed', '/api/activities/1/path', '/ready')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="requests/sec of the dev server against the production server")
+    parser.add_argument('--servers', nargs='+', default=['dev', 'waitress'], help="servers to compare")
+    parser.add_argument('--activities', default=20, type=int, help="synthetic activities in the archive")
+    parser.add_argument('--points', default=2000, type=int, help="samples per synthetic activity")
+    parser.add_argument('--requests', default=2000, type=int, help="requests sent to each server")
+    parser.add_argument('-c', '--concurrency', default=16, type=int, help="concurrent client threads")
+    parser.add_argument('-t', '--threads', default=8, type=int, help="waitress request threads")
+    parser.add_argument('-p', '--port', default=5055, type=int, help="listening port of the server under test")
+    return parser.parse_args()
+
+
+def prepare(base_path, activities, points):
+    write_activities(os.path.join(base_path, 'activities'), activities, points)
+    cfg.base_path = base_path
+    db = RunnerDB(os.path.join(base_path, DB_FILE))
+    db.migrate()
+    db.update_settings('bench', '1980-01-01', 'M', 70, '', password='unused')
+    api_key = db._get_settings().get('api_key')
+    RunnerDB.dispose()
+    return api_key
+
+
+def get(url, api_key):
+    request = urllib.request.Request(url, headers={'x-api-key': api_key, 'Accept-Encoding': 'gzip'})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        response.read()
+        return response.status
+
+
+def wait_ready(url, process, timeout=300):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("server exited with code {}".format(process.returncode))
+        try:
+            if get(url + '/ready', '') == 200:
+                return
+        except (URLError, OSError):
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("server not ready after {}s".format(timeout))
+
+
+def load(url, api_key, requests, concurrency):
+    counter = iter(range(requests))
+    lock = threading.Lock()
+    latencies, errors = [], []
+
+    def client():
+        while True:
+            with lock:
+                number = next(counter, None)
+            if number is None:
+                return
+            started = time.perf_counter()
+            try:
+                get(url + PATHS[number % len(PATHS)], api_key)
+            except (URLError, OSError) as e:
+                errors.append(e)
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'rps': len(latencies) / elapsed,
+        'p50': latencies[len(latencies) // 2] * 1000 if latencies else 0,
+        'p99': latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0
+    }
+
+
+def run(server, base_path, args, api_key):
+    command = [
+        sys.executable,
+        os.path.join(ROOT, 'bin', 'dash'), '-b', base_path, '-d', DB_FILE, '-l', '127.0.0.1', '-p',
+        str(args.port), '--server', server, '-t',
+        str(args.threads)
+    ]
+    process = subprocess.Popen(command, env=dict(os.environ, PYTHONPATH=ROOT), stdout=subprocess.DEVNULL)
+    url = 'http://127.0.0.1:{}'.format(args.port)
+    try:
+        wait_ready(url, process)
+        # one pass to warm the response cache, both servers then serve the same cached bodies
+        load(url, api_key, len(PATHS), 1)
+        return load(url, api_key, args.requests, args.concurrency)
+    finally:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    args = parse_args()
+    base_path = tempfile.mkdtemp(prefix='runnerdash-bench-')
+    try:
+        api_key = prepare(base_path, args.activities, args.points)
+        print(
+            "{:<10} {:>9} {:>7} {:>10} {:>9} {:>9}".format('server', 'requests', 'errors', 'req/s', 'p50 ms', 'p99 ms')
+        )
+        for server in args.servers:
+            result = run(server, base_path, args, api_key)
+            print(
+                "{:<10} {requests:>9} {errors:>7} {rps:>10.1f} {p50:>9.1f} {p99:>9.1f}".format(server, **result),
+                flush=True
+            )
+    finally:
+        shutil.rmtree(base_path, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
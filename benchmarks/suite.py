@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import platform
+import argparse
+import datetime
+import tempfile
+import statistics
+import subprocess
+
+import arrow
+from passlib.hash import pbkdf2_sha256
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.synthetic import write_activities  # noqa
+from runnerdash.app import build_app  # noqa
+from runnerdash.calculator import RunnerCalculator  # noqa
+from runnerdash.cache import path_cache, map_cache, response_cache  # noqa
+from runnerdash.config import cfg  # noqa
+from runnerdash.db import RunnerDB  # noqa
+from runnerdash.tcx import RunnerTCX, Activity  # noqa
+
+DB_FILE = 'runnerdash.sqlite'
+TIME_FORMAT = 'YYYY-MM-DDTHH:mm:ss.SSS'
+PASSWORD = 'bench'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="ingest, query and page render benchmarks on a synthetic archive")
+    parser.add_argument('--sizes', nargs='+', default=[10, 1000, 10000], type=int, help="history sizes measured")
+    parser.add_argument('--templates', default=10, type=int, help="synthetic tcx files parsed and cloned")
+    parser.add_argument('--points', default=1000, type=int, help="samples per synthetic activity")
+    parser.add_argument('--repeat', default=20, type=int, help="timed runs of every query and render")
+    parser.add_argument('-o', '--output', default=None, help="write the json results to this file instead of stdout")
+    parser.add_argument('--compare', default=None, help="json results of a previous run to compare against")
+    parser.add_argument(
+        '--threshold', default=1.2, type=float, help="slowdown ratio against --compare reported as a regression"
+    )
+    return parser.parse_args()
+
+
+def timings(values):
+    values = [value * 1000 for value in values]
+    return {
+        'runs': len(values),
+        'min_ms': round(min(values), 3),
+        'median_ms': round(statistics.median(values), 3),
+        'mean_ms': round(statistics.mean(values), 3),
+        'max_ms': round(max(values), 3)
+    }
+
+
+def measure(function, repeat, setup=None):
+    values = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        function()
+        values.append(time.perf_counter() - started)
+    return timings(values)
+
+
+def clear_caches():
+    path_cache.clear()
+    map_cache.clear()
+    response_cache.clear()
+
+
+def shift(date, days):
+    return arrow.get(date).shift(days=days).format(TIME_FORMAT) + 'Z' if date else date
+
+
+def clone(activity, days):
+    # the same track on another day, a new history entry without parsing another file
+    summary = dict(activity.summary)
+    for key in ('activity', 'started_at', 'completed_at'):
+        summary[key] = shift(summary[key], days)
+    return Activity(summary['started_at'], summary, activity.samples)
+
+
+def git_revision():
+    try:
+        revision = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL)
+        return revision.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_parse(paths, points):
+    activities, values = [], []
+    for path in paths:
+        started = time.perf_counter()
+        activities.append(RunnerTCX(path).to_activity())
+        values.append(time.perf_counter() - started)
+    result = timings(values)
+    result['points_per_sec'] = round(len(paths) * points / sum(values), 1)
+    result['bytes_per_sec'] = round(sum(os.path.getsize(path) for path in paths) / sum(values), 1)
+    return activities, result
+
+
+def bench_insert(db, templates, first, last):
+    started = time.perf_counter()
+    for number in range(first, last):
+        db._load_activity(clone(templates[number % len(templates)], number))
+    elapsed = time.perf_counter() - started
+    count = last - first
+    samples = sum(len(templates[number % len(templates)].samples.time) for number in range(first, last))
+    return {
+        'activities': count,
+        'seconds': round(elapsed, 3),
+        'activities_per_sec': round(count / elapsed, 1) if elapsed else None,
+        'samples_per_sec': round(samples / elapsed, 1) if elapsed else None
+    }
+
+
+def bench_queries(app, client, repeat):
+    calculator = RunnerCalculator()
+    db = calculator.db
+    activity_id = db.find_random_activity().get('id')
+    results = {
+        'find_all_activities': measure(lambda: list(db.find_all_activities()), repeat),
+        'activity_table': measure(calculator._activity_table, repeat)
+    }
+    with app.test_request_context():
+        results['random_activity_map_cold'] = measure(calculator._get_random_activity_map, repeat, clear_caches)
+        results['random_activity_map_warm'] = measure(calculator._get_random_activity_map, repeat)
+
+    def dashboard():
+        response = client.post('/dashboard', data={'activity-id': str(activity_id)})
+        assert response.status_code == 200, response.status_code
+
+    results['dashboard_post_cold'] = measure(dashboard, repeat, clear_caches)
+    results['dashboard_post_warm'] = measure(dashboard, repeat)
+    return results
+
+
+def prepare(base_path):
+    cfg.base_path = base_path
+    cfg.db_file = os.path.join(base_path, DB_FILE)
+    db = RunnerDB(cfg.db_file)
+    db.migrate()
+    password = pbkdf2_sha256.hash(PASSWORD, rounds=1000)
+    db.update_settings('bench', '1980-01-01', 'M', 70, 'bench', password=password)
+    app = build_app()
+    client = app.test_client()
+    response = client.post('/login', data={'signin-name': 'bench', 'signin-pass': PASSWORD})
+    assert response.status_code == 302, response.status_code
+    return db, app, client
+
+
+def compare(results, baseline, threshold):
+    # every median present in both runs, slower than the threshold ratio is a regression
+    regressions = []
+    for size, benches in results['sizes'].items():
+        for name, result in benches.items():
+            previous = baseline.get('sizes', {}).get(size, {}).get(name, {})
+            if result.get('median_ms') and previous.get('median_ms'):
+                ratio = result['median_ms'] / previous['median_ms']
+            elif result.get('activities_per_sec') and previous.get('activities_per_sec'):
+                ratio = previous['activities_per_sec'] / result['activities_per_sec']
+            else:
+                continue
+            if ratio > threshold:
+                regressions.append({'size': size, 'bench': name, 'ratio': round(ratio, 2)})
+    return regressions
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    base_path = tempfile.mkdtemp(prefix='runnerdash-bench-')
+    try:
+        paths = write_activities(os.path.join(base_path, 'templates'), args.templates, args.points)
+        db, app, client = prepare(base_path)
+        templates, parse = bench_parse(paths, args.points)
+        results = {
+            'meta': {
+                'date': datetime.datetime.utcnow().isoformat() + 'Z',
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'points': args.points,
+                'templates': args.templates,
+                'repeat': args.repeat
+            },
+            'parse': parse,
+            'sizes': {}
+        }
+        size = 0
+        for target in sorted(args.sizes):
+            insert = bench_insert(db, templates, size, target)
+            size = target
+            results['sizes'][str(size)] = dict(bench_queries(app, client, args.repeat), insert=insert)
+            logging.warning("measured history size %d", size)
+        if args.compare:
+            with open(args.compare) as fd:
+                results['regressions'] = compare(results, json.load(fd), args.threshold)
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if args.output:
+            with open(args.output, 'w') as fd:
+                fd.write(output + '\n')
+        else:
+            print(output)
+        return 1 if results.get('regressions') else 0
+    finally:
+        RunnerDB.dispose()
+        shutil.rmtree(base_path, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import os
+import math
+import random
+import datetime
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.000Z'
+
+HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<TrainingCenterDatabase xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2">\n'
+    '<Activities><Activity Sport="Running"><Id>{start}</Id>\n'
+    '<Lap StartTime="{start}"><TotalTimeSeconds>{duration}</TotalTimeSeconds><DistanceMeters>{distance:.1f}'
+    '</DistanceMeters><Calories>0</Calories><Intensity>Active</Intensity><TriggerMethod>Manual</TriggerMethod>'
+    '<Track>\n'
+)
+TRACKPOINT = (
+    '<Trackpoint><Time>{time}</Time><Position><LatitudeDegrees>{lat:.6f}</LatitudeDegrees><LongitudeDegrees>'
+    '{lon:.6f}</LongitudeDegrees></Position><AltitudeMeters>{alt:.1f}</AltitudeMeters><DistanceMeters>{distance:.1f}'
+    '</DistanceMeters><HeartRateBpm><Value>{hr}</Value></HeartRateBpm></Trackpoint>\n'
+)
+FOOTER = '</Track></Lap><Creator><Name>RunnerUp</Name></Creator></Activity></Activities></TrainingCenterDatabase>\n'
+
+
+def synthetic_tcx(start, points, seed=0):
+    # one sample per second on a loop around a fixed point, about 10 km/h with some noise
+    rnd = random.Random(seed)
+    distance, alt = 0.0, 100.0
+    body = []
+    for second in range(points):
+        distance += 2.5 + rnd.random()
+        alt += rnd.uniform(-0.5, 0.5)
+        body.append(
+            TRACKPOINT.format(
+                time=(start + datetime.timedelta(seconds=second)).strftime(TIME_FORMAT),
+                lat=45.0 + 0.01 * math.sin(second / 500.0),
+                lon=9.0 + 0.01 * math.cos(second / 500.0),
+                alt=alt,
+                distance=distance,
+                hr=120 + second % 50
+            )
+        )
+    return HEADER.format(start=start.strftime(TIME_FORMAT), duration=points, distance=distance) + ''.join(body) + FOOTER
+
+
+def write_activities(folder, count, points, first=datetime.datetime(2017, 1, 1, 8)):
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for number in range(count):
+        path = os.path.join(folder, 'synthetic-{:05d}.tcx'.format(number))
+        with open(path, 'w') as fd:
+            fd.write(synthetic_tcx(first + datetime.timedelta(days=number), points, seed=number))
+        paths.append(path)
+    return paths
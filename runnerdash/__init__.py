@@ -1,3 +1,3 @@
 # -*- coding: utf-8 -*-
-from .app import RunnerDash  # noqa
+from .app import RunnerDash, create_app  # noqa
 from .utils import setup_logging, handle_base_path  # noqa
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import numpy
+
+KILOMETER = 1000.0
+MILE = 1609.344
+BEST_EFFORTS = (('1k', 1000.0), ('5k', 5000.0), ('10k', 10000.0), ('Half Marathon', 21097.5), ('Marathon', 42195.0))
+CLIMB_MIN_GAIN = 10.0
+CLIMB_SMOOTHING = 15
+
+
+def _fill_missing(altitude):
+    # carry the last known altitude over gps gaps, leading gaps take the first known value
+    altitude = numpy.asarray(altitude, dtype=numpy.float64)
+    missing = numpy.isnan(altitude)
+    if missing.all():
+        return numpy.zeros_like(altitude)
+    index = numpy.where(missing, 0, numpy.arange(len(altitude)))
+    numpy.maximum.accumulate(index, out=index)
+    filled = altitude[index]
+    first = numpy.argmax(~missing)
+    filled[:first] = altitude[first]
+    return filled
+
+
+def _cumulative_gain(altitude):
+    steps = numpy.diff(altitude)
+    return numpy.concatenate(([0.0], numpy.cumsum(numpy.where(steps > 0, steps, 0.0))))
+
+
+def _value_at(distance, values, marks):
+    # the last time each mark is reached, linear between samples, so standing still on a mark never counts
+    index = numpy.clip(numpy.searchsorted(distance, marks, side='right') - 1, 0, len(distance) - 2)
+    span = distance[index + 1] - distance[index]
+    fraction = numpy.divide(marks - distance[index], span, out=numpy.zeros_like(span), where=span > 0)
+    return values[index] + numpy.clip(fraction, 0.0, 1.0) * (values[index + 1] - values[index])
+
+
+def _pace(duration, length):
+    return float(duration / (length / KILOMETER)) if length > 0 else 0.0
+
+
+def splits(distance, time, gain, unit):
+    total = distance[-1]
+    edges = numpy.append(numpy.arange(0.0, total, unit), total)
+    lengths = numpy.diff(edges)
+    durations = numpy.diff(_value_at(distance, time, edges))
+    gains = numpy.diff(_value_at(distance, gain, edges))
+    return [
+        {
+            'split': number,
+            'distance': round(float(length), 1),
+            'duration': round(float(duration), 1),
+            'pace': round(_pace(duration, length), 1),
+            'gain': round(float(elevation), 1)
+        } for number, (length, duration, elevation) in enumerate(zip(lengths, durations, gains), 1) if length > 0
+    ]
+
+
+def best_efforts(distance, time):
+    # every sample is tried as the end of the effort, its start is found on the cumulative distance
+    efforts = []
+    for name, length in BEST_EFFORTS:
+        first = numpy.searchsorted(distance, distance[0] + length)
+        if first >= len(distance):
+            break
+        ends = numpy.arange(first, len(distance))
+        elapsed = time[ends] - _value_at(distance, time, distance[ends] - length)
+        best = int(numpy.argmin(elapsed))
+        efforts.append(
+            {
+                'name': name,
+                'distance': length,
+                'duration': round(float(elapsed[best]), 1),
+                'pace': round(_pace(elapsed[best], length), 1),
+                'end': round(float(distance[ends[best]]), 1)
+            }
+        )
+    return efforts
+
+
+def climbs(distance, altitude):
+    # runs of rising smoothed altitude, small gps jitter is averaged away before looking at the slope
+    window = min(CLIMB_SMOOTHING, len(altitude))
+    padded = numpy.concatenate(([0.0], numpy.cumsum(altitude)))
+    smoothed = (padded[window:] - padded[:-window]) / window
+    offset = window // 2
+    rising = numpy.diff(smoothed) > 0
+    edges = numpy.flatnonzero(numpy.diff(numpy.concatenate(([0], rising.astype(numpy.int8), [0]))))
+    segments = []
+    for start, end in zip(edges[::2], edges[1::2]):
+        gain = smoothed[end] - smoothed[start]
+        if gain < CLIMB_MIN_GAIN:
+            continue
+        begin, finish = distance[start + offset], distance[end + offset]
+        segments.append(
+            {
+                'start': round(float(begin), 1),
+                'distance': round(float(finish - begin), 1),
+                'gain': round(float(gain), 1),
+                'grade': round(float(gain / (finish - begin) * 100), 1) if finish > begin else 0.0
+            }
+        )
+    return segments
+
+
+def analyze(samples):
+    distance = numpy.maximum.accumulate(numpy.asarray(samples.distance, dtype=numpy.float64))
+    if len(distance) < 2 or distance[-1] <= 0:
+        return {'splits_km': [], 'splits_mile': [], 'best_efforts': [], 'climbs': []}
+    time = numpy.asarray(samples.time, dtype=numpy.float64) - samples.time[0]
+    altitude = _fill_missing(samples.altitude)
+    gain = _cumulative_gain(altitude)
+    return {
+        'splits_km': splits(distance, time, gain, KILOMETER),
+        'splits_mile': splits(distance, time, gain, MILE),
+        'best_efforts': best_efforts(distance, time),
+        'climbs': climbs(distance, altitude)
+    }
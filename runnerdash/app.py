@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 
+import os
+import atexit
 import logging
 
 from flask import Flask
@@ -10,15 +12,159 @@ from .config import cfg
 from .db import RunnerDB
 from .notify import RunnerNotify
 from .login import login_manager
-from .views import IndexView, APIView, DashboardView, SettingsView, StatisticsView, LoginView, LogoutView, WizardView
+from .upload import upload_queue
+from .status import status
+from .utils import handle_base_path
+from .views import (
+    IndexView, APIView, APIJobView, APIActivitiesView, APIActivitySeriesView, DashboardView, SettingsView,
+    StatisticsView, LoginView, LogoutView, WizardView, ReadyView, MetricsView
+)
+from .metrics import metrics
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import waitress
+except ImportError:
+    waitress = None
 
 log = logging.getLogger(__name__)
 
+NAME = 'runnerdash'
+SERVERS = ('dev', 'waitress')
+SECRET_FILE = 'secret_key'
+MIGRATE_LOCK = 'migrate.lock'
+SERVICES_LOCK = 'services.lock'
+
+
+def _lock(name, blocking=True):
+    # advisory lock in the base path shared by every process serving the same db, None when already taken
+    fd = open(os.path.join(cfg.base_path, name), 'w')
+    if fcntl is None:
+        return fd
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        fd.close()
+        return None
+    return fd
+
+
+def _secret_key():
+    # kept on disk so sessions are valid on every worker process and survive a restart
+    path = os.path.join(cfg.base_path, SECRET_FILE)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        pass
+    else:
+        with os.fdopen(fd, 'w') as secret:
+            secret.write(RunnerDB(cfg.db_file)._generate_random_api_key())
+    with open(path) as secret:
+        return secret.read().strip()
+
+
+def _migrate():
+    # worker processes start together, the first one upgrades the schema and the others find it current
+    lock = _lock(MIGRATE_LOCK)
+    try:
+        RunnerDB(cfg.db_file).migrate()
+    finally:
+        lock.close()
+
+
+def _release_db(exception=None):
+    RunnerDB(cfg.db_file).release()
+
+
+def build_app(devel=False):
+    app = Flask(NAME, template_folder="templates")
+    app.add_url_rule('/', view_func=IndexView.as_view('index_view'))
+    app.add_url_rule('/api', view_func=APIView.as_view('api_view'))
+    app.add_url_rule('/api/jobs/<job_id>', view_func=APIJobView.as_view('api_job_view'))
+    app.add_url_rule('/api/activities', view_func=APIActivitiesView.as_view('api_activities_view'))
+    app.add_url_rule(
+        '/api/activities/<int:activity_id>/<series>',
+        view_func=APIActivitySeriesView.as_view('api_activity_series_view')
+    )
+    app.add_url_rule('/wizard', view_func=WizardView.as_view('wizard_view'))
+    app.add_url_rule('/login', view_func=LoginView.as_view('login_view'))
+    app.add_url_rule('/logout', view_func=LogoutView.as_view('logout_view'))
+    app.add_url_rule('/dashboard', view_func=DashboardView.as_view('dashboard_view'))
+    app.add_url_rule('/settings', view_func=SettingsView.as_view('settings_view'))
+    app.add_url_rule('/statistics', view_func=StatisticsView.as_view('statistics_view'))
+    app.add_url_rule('/ready', view_func=ReadyView.as_view('ready_view'))
+    if cfg.metrics:
+        app.add_url_rule('/metrics', view_func=MetricsView.as_view('metrics_view'))
+    if cfg.metrics or cfg.profile:
+        metrics.init_app(app)
+    app.teardown_appcontext(_release_db)
+    gmap_apikey = RunnerDB(cfg.db_file).get_gmaps_api_key()
+    if gmap_apikey:
+        GoogleMaps(app, key=gmap_apikey)
+    login_manager.login_view = "login_view"
+    login_manager.setup_app(app)
+    if devel:
+        app.config['TEMPLATES_AUTO_RELOAD'] = True
+    app.secret_key = _secret_key()
+    return app
+
+
+class RunnerServices(object):
+    # filesystem notifier, archive backfill and upload workers: one set per base path, whatever the process count
+    def __init__(self):
+        self.lock = None
+        self.notify = None
+
+    def start(self):
+        upload_queue.spool()
+        self.lock = _lock(SERVICES_LOCK, blocking=False)
+        if self.lock is None:
+            log.info("background services are running in another process, pid: %d", os.getpid())
+            status.set_phase('ready')
+            return False
+        upload_queue.start()
+        # the archive backfill runs in the background so the server binds without waiting for it
+        status.set_phase('backfill')
+        self.notify = RunnerNotify()
+        self.notify.start()
+        return True
+
+    def stop(self):
+        if self.lock is None:
+            return
+        self.notify.stop()
+        upload_queue.stop()
+        self.lock.close()
+        self.lock = None
+
+
+def create_app(base_path=None, db_file=None, services=True, **options):
+    # wsgi entry point for an external server, e.g. `waitress-serve --call runnerdash:create_app`
+    cfg.base_path = base_path or handle_base_path()
+    cfg.db_file = db_file or os.path.join(cfg.base_path, 'runnerdash.sqlite')
+    cfg.update(options)
+    status.set_phase('database')
+    _migrate()
+    app = build_app()
+    if services:
+        runner_services = RunnerServices()
+        runner_services.start()
+        atexit.register(runner_services.stop)
+    else:
+        # services run elsewhere, uploads are only spooled here and this process is ready to serve
+        upload_queue.spool()
+        status.set_phase('ready')
+    return app
+
 
 class RunnerDash(object):
-    NAME = 'runnerdash'
+    NAME = NAME
 
-    def __init__(self, base_path, db_file, host, port, debug, devel):
+    def __init__(self, base_path, db_file, host, port, debug, devel, **options):
         self.port = port
         self.host = host
         self.debug = debug
@@ -26,33 +172,30 @@ class RunnerDash(object):
         self.base_path = base_path
         cfg.db_file = db_file
         cfg.base_path = base_path
-        self.app = Flask(self.NAME, template_folder="templates")
-        self.notify = RunnerNotify()
+        cfg.update(options)
+        if cfg.server == 'waitress' and waitress is None:
+            raise RuntimeError("waitress is not installed, install it with `pip install runnerdash[production]`")
+        status.set_phase('database')
+        _migrate()
+        self.app = None
+        self.services = RunnerServices()
 
     def start(self):
         log.info(
-            'starting runnerdash, base_path: %s, db: %s, port: %d, debug: %s', cfg.base_path, cfg.db_file, self.port,
-            self.debug
+            'starting runnerdash, base_path: %s, db: %s, port: %d, debug: %s, server: %s', cfg.base_path, cfg.db_file,
+            self.port, self.debug, cfg.server
         )
-        self.app.add_url_rule('/', view_func=IndexView.as_view('index_view'))
-        self.app.add_url_rule('/api', view_func=APIView.as_view('api_view'))
-        self.app.add_url_rule('/wizard', view_func=WizardView.as_view('wizard_view'))
-        self.app.add_url_rule('/login', view_func=LoginView.as_view('login_view'))
-        self.app.add_url_rule('/logout', view_func=LogoutView.as_view('logout_view'))
-        self.app.add_url_rule('/dashboard', view_func=DashboardView.as_view('dashboard_view'))
-        self.app.add_url_rule('/settings', view_func=SettingsView.as_view('settings_view'))
-        self.app.add_url_rule('/statistics', view_func=StatisticsView.as_view('statistics_view'))
-        self.notify.start()
-        db = RunnerDB(cfg.db_file)
-        gmap_apikey = db.get_gmaps_api_key()
-        if gmap_apikey:
-            GoogleMaps(self.app, key=gmap_apikey)
-        login_manager.login_view = "login_view"
-        login_manager.setup_app(self.app)
-        if self.devel:
-            self.app.config['TEMPLATES_AUTO_RELOAD'] = True
-        self.app.secret_key = db._generate_random_api_key()
-        self.app.run(host=self.host, port=self.port, debug=self.debug, use_reloader=self.devel)
+        self.app = build_app(self.devel)
+        self.services.start()
+        self.serve()
+
+    def serve(self):
+        if cfg.server == 'waitress':
+            log.info("serving with waitress, threads: %d", cfg.threads)
+            waitress.serve(self.app, host=self.host, port=self.port, threads=cfg.threads, ident=NAME)
+        else:
+            self.app.run(host=self.host, port=self.port, debug=self.debug, use_reloader=self.devel)
 
     def stop(self):
-        self.notify.stop()
+        self.services.stop()
+        RunnerDB.dispose()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    def __init__(self, size):
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class TTLCache(object):
+    _MISSING = object()
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, loader, version=None):
+        # a different version reloads the entry before its ttl, e.g. after a write from another process
+        with self._lock:
+            value, expires, cached_version = self._items.get(key, (self._MISSING, 0, None))
+        if value is self._MISSING or expires < time.monotonic() or cached_version != version:
+            value = loader()
+            with self._lock:
+                self._items[key] = (value, time.monotonic() + self.ttl, version)
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._items.clear()
+
+
+path_cache = LRUCache(256)
+map_cache = LRUCache(64)
+response_cache = LRUCache(128)
+auth_cache = TTLCache(300)
@@ -1,104 +1,228 @@
 # -*- coding: utf-8 -*-
-import random
+import time
 import logging
+from collections import namedtuple
 
-import arrow
+import numpy
 
 from .db import RunnerDB
 from .maps import RunnerMap
 from .config import cfg
+from .cache import path_cache, map_cache
+from .polyline import zoom_tolerance, simplify, encode
+from .heartrate import ZONE_COLUMNS, zone_times, efficiency
 
 log = logging.getLogger(__name__)
 
+Path = namedtuple('Path', ['latitude', 'longitude', 'encoded'])
+RenderedMap = namedtuple('RenderedMap', ['js', 'html'])
+
 
 class RunnerCalculator(object):
-    GRANULARITY = 10
-    MET_TABLE = {
-        'running': {
-            4.0: 3.0,
-            4.5: 3.5,
-            6.4: 6.0,
-            8.0: 8.3,
-            9.5: 9.8,
-            11.2: 11,
-            12.9: 11.8,
-            14.5: 12.8,
-            16.0: 14.5,
-            17.7: 16.0,
-            19.3: 19.0,
-            20.9: 19.8,
-            22.5: 23.0
-        }
-    }
+    SERIES_POINTS = 500
+    FULLMAP_ZOOM = 16
+    TRACKMAP_ZOOM = 15
+    PATH_PIXELS = 1.0
+    PAGE_SIZE = 50
+    STATISTICS_PERIODS = (('day', 30), ('week', 26), ('month', 24), ('year', 10))
 
     def __init__(self):
         self.gmap = RunnerMap()
         self.db = RunnerDB(cfg.db_file)
 
-    def _calculate_calories(self, weight, pace, duration, activity_type):
-        speed = 1 / pace
-        met_table = self.MET_TABLE[activity_type]
-        value = min(met_table.keys(), key=lambda x: abs(x - speed))
-        met = met_table[value]
-        return met * weight * duration / 60 / 60
-
-    def _calculate_duration(self, start, end):
-        duration = (end - start).total_seconds()
-        if duration < 60:
-            return '{} sec'.format(duration)
-        else:
-            return '{0:.0f} min {1:.0f} sec'.format((duration % 3600) // 60, duration % 60)
-
-    def _activity_table(self):
-        for activity in self.db.find_all_activities():
-            start = arrow.get(activity.get('started_at'))
-            end = arrow.get(activity.get('completed_at'))
-            calories = activity.get('calories')
-            if not calories:
-                calories = self._calculate_calories(
-                    self.db._get_settings().get('weight'),
-                    activity.get('pace_hours'), activity.get('duration'), activity.get('activity_type')
-                )
-
-            yield {
+    def _activity_table(self, before=None):
+        return [
+            {
                 'activity-id': activity.get('id'),
-                'date': start.format('ddd DD MMM YYYY'),
-                'start_time': start.format('HH:mm'),
-                'type': activity.get('activity_type').capitalize(),
-                'distance': '{0:.2f} km'.format(activity.get('distance') / 1000),
-                'duration': self._calculate_duration(start, end),
-                'pace': '{} min/km'.format(activity.get('pace')),
-                'calories': '{0:.0f}'.format(calories)
-            }
-
-    def _get_path(self, trackpoints):
-        return [{
-            'lat': trackpoint.get('latitude'),
-            'lng': trackpoint.get('longitude')
-        } for trackpoint in trackpoints]
+                'date': activity.get('date_label'),
+                'start_time': activity.get('start_time_label'),
+                'type': activity.get('type'),
+                'distance': activity.get('distance'),
+                'duration': activity.get('duration_label'),
+                'pace': activity.get('pace'),
+                'calories': activity.get('calories'),
+                'started_at': activity.get('started_at')
+            } for activity in self.db.find_activity_summaries(before, self.PAGE_SIZE)
+        ]
 
-    def _get_random_activity_map(self):
-        activity = random.choice(list(self.db.find_all_activities()))
+    def _activity_list(self, before=None, limit=None):
+        return [
+            {
+                'id': activity.get('id'),
+                'activity': activity.get('activity'),
+                'started_at': activity.get('started_at'),
+                'completed_at': activity.get('completed_at'),
+                'type': activity.get('activity_type'),
+                'distance': activity.get('distance'),
+                'duration': activity.get('duration'),
+                'pace': activity.get('pace'),
+                'calories': activity.get('calories'),
+                'calories_estimated': bool(activity.get('calories_estimated')),
+                'ascent': activity.get('ascent'),
+                'descent': activity.get('descent'),
+                'heart_rate_avg': activity.get('heart_rate_avg'),
+                'heart_rate_max': activity.get('heart_rate_max'),
+                'updated_at': activity.get('updated_at')
+            } for activity in self.db.find_activities_page(before, limit or self.PAGE_SIZE)
+        ]
 
-        trackpoints = self.db.track_points.find(activity_id=activity.get('id'))
-        path = self._get_path(trackpoints)
+    def _path_series(self, activity_id, zoom=None):
+        zoom = self.TRACKMAP_ZOOM if zoom is None else zoom
+        path = self._get_path(activity_id, zoom)
+        if not path.latitude:
+            return {'zoom': zoom, 'encoded': '', 'start': None, 'end': None}
+        return {
+            'zoom': zoom,
+            'encoded': path.encoded,
+            'start': [path.latitude[0], path.longitude[0]],
+            'end': [path.latitude[-1], path.longitude[-1]]
+        }
 
-        start_point = path[0]
-        middle_point = path[len(path) // 2]
-        end_point = path[-1]
+    def _speed_series(self, activity_id, points=None):
+        times, speeds = self.db.find_speed_series(activity_id, points or self.SERIES_POINTS)
+        return {'time': times, 'speed': numpy.round(speeds.astype(numpy.float64), 2)}
+
+    def _heart_rate_series(self, activity_id, points=None):
+        samples = self.db.load_samples(activity_id)
+        size = len(samples.time)
+        index = numpy.unique(numpy.linspace(0, size - 1, min(points or self.SERIES_POINTS, size)).astype(numpy.int64))
+        return {'time': samples.time[index], 'heart_rate': samples.heart_rate[index].astype(numpy.float64)}
+
+    def _get_path(self, activity_id, zoom):
+        # the tolerance only depends on the activity latitude and the zoom, so the zoom keys the simplified path
+        key = (int(activity_id), zoom)
+        path = path_cache.get(key)
+        if path is None:
+            samples = self.db.load_samples(activity_id)
+            latitude = float(samples.latitude[0]) if len(samples.latitude) else 0.0
+            keep = simplify(samples.latitude, samples.longitude, zoom_tolerance(latitude, zoom, self.PATH_PIXELS))
+            latitude, longitude = samples.latitude[keep], samples.longitude[keep]
+            path = Path(latitude.tolist(), longitude.tolist(), encode(latitude, longitude))
+            path_cache.set(key, path)
+        return path
+
+    def _render_path_map(self, name, activity_id, zoom, **kwargs):
+        path = self._get_path(activity_id, zoom)
+        if not path.latitude:
+            return self.gmap.render(name, 0, 0, zoom=zoom, **kwargs)
+        middle = len(path.latitude) // 2
 
         markers = [
             {
                 'color': 'green',
-                'lat': start_point['lat'],
-                'lng': start_point['lng'],
+                'lat': path.latitude[0],
+                'lng': path.longitude[0],
                 'label': 'Start!'
             }, {
                 'color': 'red',
-                'lat': end_point['lat'],
-                'lng': end_point['lng'],
+                'lat': path.latitude[-1],
+                'lng': path.longitude[-1],
                 'label': 'End!'
             }
         ]
 
-        return self.gmap.render('fullmap', middle_point['lat'], middle_point['lng'], path=path, markers=markers)
+        return self.gmap.render(
+            name,
+            path.latitude[middle],
+            path.longitude[middle],
+            zoom=zoom,
+            encoded_path=path.encoded,
+            markers=markers,
+            **kwargs
+        )
+
+    def _get_random_activity_map(self):
+        activity = self.db.find_random_activity()
+        if not activity:
+            return None
+        key = ('fullmap', activity.get('id'), self.FULLMAP_ZOOM)
+        fullmap = map_cache.get(key)
+        if fullmap is None:
+            gmap = self._render_path_map('fullmap', activity.get('id'), self.FULLMAP_ZOOM)
+            fullmap = RenderedMap(gmap.js, gmap.html)
+            map_cache.set(key, fullmap)
+        return fullmap
+
+    @staticmethod
+    def _zone_rows(zones):
+        total = sum(zones) or 1
+        return [
+            {
+                'zone': number,
+                'minutes': round(seconds / 60, 1),
+                'share': round(seconds / total * 100, 1)
+            } for number, seconds in enumerate(zones, 1)
+        ]
+
+    @staticmethod
+    def _heart_rate_fields(row):
+        # works on both rollup rows and the heart rate row of a single activity
+        ratio = efficiency(row.get('hr_distance') or 0, row.get('heartbeats') or 0)
+        drift = row.get('drift_total') / row.get('drift_count') if row.get('drift_count') else row.get('drift')
+        return {
+            'efficiency': round(ratio, 2) if ratio else '-',
+            'drift': round(drift, 1) if drift is not None else '-'
+        }
+
+    def _rollup_trend(self, period, limit):
+        rows = [
+            dict(
+                {
+                    'period': row.get('period_key'),
+                    'count': row.get('count'),
+                    'distance': round(row.get('distance') / 1000, 2),
+                    'duration': round(row.get('duration') / 3600, 2),
+                    'calories': int(row.get('calories')),
+                    'ascent': int(row.get('ascent')),
+                    'pace': time.strftime("%M:%S", time.gmtime(row.get('best_pace'))) if row.get('best_pace') else '-',
+                    'zones': ' / '.join('{:.0f}'.format((row.get(zone) or 0) / 60) for zone in ZONE_COLUMNS)
+                }, **self._heart_rate_fields(row)
+            ) for row in self.db.find_rollups(period, limit)
+        ]
+        # newest first for the tables, the charts read it the other way around
+        return {'period': period, 'rows': rows, 'chart': list(reversed(rows))}
+
+    def _statistics(self):
+        return [self._rollup_trend(period, limit) for period, limit in self.STATISTICS_PERIODS]
+
+    def _heart_rate_history(self):
+        # the whole history is the sum of the yearly rollups
+        years = self.db.find_rollups('year', None)
+        totals = {column: sum(row.get(column) or 0 for row in years) for column in ZONE_COLUMNS}
+        for column in ('hr_seconds', 'heartbeats', 'hr_distance', 'drift_total', 'drift_count'):
+            totals[column] = sum(row.get(column) or 0 for row in years)
+        if not totals['hr_seconds']:
+            return None
+        return dict(
+            self._heart_rate_fields(totals),
+            zones=self._zone_rows([totals[column] for column in ZONE_COLUMNS]),
+            max_hr=self.db._max_heart_rate()
+        )
+
+    def _activity_heart_rate(self, activity_id):
+        row = self.db.find_heart_rate(activity_id)
+        if not row:
+            return None
+        max_hr = self.db._max_heart_rate()
+        zones = zone_times(numpy.frombuffer(row.get('histogram'), dtype=numpy.float32), max_hr)
+        return dict(self._heart_rate_fields(row), zones=self._zone_rows(zones), max_hr=max_hr)
+
+    @staticmethod
+    def _clock(seconds):
+        return time.strftime("%H:%M:%S" if seconds >= 3600 else "%M:%S", time.gmtime(seconds))
+
+    def _activity_analysis(self, activity_id):
+        analysis = self.db.find_analysis(activity_id)
+        for split in analysis['splits_km'] + analysis['splits_mile']:
+            split.update({'duration': self._clock(split['duration']), 'pace': self._clock(split['pace'])})
+        for effort in analysis['best_efforts']:
+            effort.update(
+                {
+                    'duration': self._clock(effort['duration']),
+                    'pace': self._clock(effort['pace']),
+                    'end': round(effort['end'] / 1000, 2)
+                }
+            )
+        for climb in analysis['climbs']:
+            climb.update({'start': round(climb['start'] / 1000, 2), 'distance': round(climb['distance'] / 1000, 2)})
+        return analysis
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import numpy
+
+# km/h -> MET, from the compendium of physical activities
+MET_TABLE = {
+    'running': {
+        4.0: 3.0,
+        4.5: 3.5,
+        6.4: 6.0,
+        8.0: 8.3,
+        9.5: 9.8,
+        11.2: 11,
+        12.9: 11.8,
+        14.5: 12.8,
+        16.0: 14.5,
+        17.7: 16.0,
+        19.3: 19.0,
+        20.9: 19.8,
+        22.5: 23.0
+    },
+    'walking': {
+        3.2: 2.8,
+        4.0: 3.0,
+        4.8: 3.5,
+        5.6: 4.3,
+        6.4: 5.0,
+        7.2: 7.0
+    },
+    'biking': {
+        12.0: 4.0,
+        17.7: 6.8,
+        20.9: 8.0,
+        24.1: 10.0,
+        28.2: 12.0,
+        32.2: 15.8
+    }
+}
+REST_MET = 1.0
+
+# sorted breakpoints per activity type, standing still burns the resting rate
+BREAKPOINTS = {
+    activity_type: (
+        numpy.array([0.0] + sorted(table), dtype=numpy.float64),
+        numpy.array([REST_MET] + [table[speed] for speed in sorted(table)], dtype=numpy.float64)
+    )
+    for activity_type, table in MET_TABLE.items()
+}
+
+
+def met(activity_type, speeds):
+    speeds_table, mets = BREAKPOINTS[activity_type]
+    return numpy.interp(speeds, speeds_table, mets)
+
+
+def calculate_calories(weight, pace, duration, activity_type):
+    speed = 1 / pace
+    return float(met(activity_type, speed)) * weight * duration / 60 / 60
+
+
+def estimate_calories(weight, activity):
+    # activities we cannot estimate yet keep 0 and are refreshed once the weight is known
+    pace = activity.get('pace_hours')
+    activity_type = activity.get('activity_type')
+    if not weight or not pace or activity_type not in MET_TABLE:
+        return 0
+    return calculate_calories(weight, pace, activity.get('duration'), activity_type)
+
+
+def _durations(times):
+    # windows of a speed series are labelled with their end, the first one is as long as the second
+    if len(times) < 2:
+        return numpy.zeros(len(times))
+    return numpy.diff(times, prepend=2 * times[0] - times[1])
+
+
+def series_calories(weight, activity_type, times, speeds):
+    # energy integrated over every window of the speed series instead of the average pace
+    if not weight or activity_type not in MET_TABLE or not len(speeds):
+        return 0
+    return float((met(activity_type, speeds) * _durations(times)).sum() * weight / 3600)
+
+
+def batch_calories(weight, activities):
+    # (activity_type, times, speeds) per activity: one interpolation per type over all windows at once
+    calories = numpy.zeros(len(activities))
+    if not weight:
+        return calories
+    for activity_type in set(activity[0] for activity in activities) & set(MET_TABLE):
+        index = [number for number, activity in enumerate(activities) if activity[0] == activity_type]
+        speeds = numpy.concatenate([activities[number][2] for number in index])
+        durations = numpy.concatenate([_durations(activities[number][1]) for number in index])
+        owners = numpy.repeat(index, [len(activities[number][2]) for number in index])
+        energy = met(activity_type, speeds) * durations * weight / 3600
+        calories += numpy.bincount(owners, weights=energy, minlength=len(activities))
+    return calories
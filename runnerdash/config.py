@@ -10,6 +10,23 @@ class RunnerConfig(dict):
         self.base_dir = '.config/runnerdash'
         self.log_file = 'runnerdash.log'
         self.log_format = "%(asctime)s [%(levelname)s] pid(%(process)d): %(message)s"
+        # rows per bulk statement on rollup rebuilds and calorie updates, samples are one blob row per activity
+        self.chunk_size = 1000
+        self.db_pool_size = 8
+        self.db_pool_overflow = 16
+        self.workers = None
+        self.queue_depth = None
+        self.upload_workers = 2
+        self.notify_debounce = 2.0
+        self.notify_queue_size = 256
+        self.notify_batch_size = 32
+        self.notify_retries = 5
+        self.server = 'dev'
+        self.threads = 8
+        self.upload_poll = 2.0
+        self.metrics = False
+        self.profile = False
+        self.profile_threshold = 1.0
 
     def __getattr__(self, key):
         return self[key]
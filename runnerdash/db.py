@@ -1,20 +1,32 @@
 # -*- coding: utf-8 -*-
 import os
+import json
+import time
+import random
+import hashlib
 import logging
+import threading
 from binascii import hexlify
-from tempfile import NamedTemporaryFile
-from collections import namedtuple
 
 import arrow
+import numpy
 import dataset
 import sqlalchemy
 
-from .tcx import RunnerTCX
+from .tcx import TrackPoint, read_activity
+from .utils import format_duration
+from .config import cfg
+from .series import SAMPLE_TYPES, to_epoch, to_samples, speed_series, samples_to_blobs, samples_from_blobs
+from .cache import map_cache, auth_cache
+from .calories import estimate_calories, series_calories, batch_calories
+from .ingest import RunnerBackfill
+from .statistics import TOTALS, HR_TOTALS, SUMS, rollup, rollup_rows
+from .heartrate import heart_rate_summary, heart_rate_totals, max_heart_rate
+from .analysis import analyze
+from .metrics import metrics
 
 log = logging.getLogger(__name__)
 
-Activity = namedtuple('Activity', ['start_date', 'tcx'])
-
 
 class RunnerDBError(Exception):
     pass
@@ -25,11 +37,80 @@ class RunnerDB(object):
     TABLE_SETTINGS = 'settings'
     TABLE_HEART_RATE_VALUES = 'heart_rate_values'
     TABLE_TRACK_POINTS = 'track_points'
-
-    def __init__(self, storage_path):
+    TABLE_IMPORTS = 'imports'
+    TABLE_SPEED_SERIES = 'speed_series'
+    TABLE_SAMPLES = 'samples'
+    TABLE_UPLOAD_JOBS = 'upload_jobs'
+    TABLE_ROLLUPS = 'rollups'
+    TABLE_ANALYSIS = 'analysis'
+    TABLE_HEART_RATE = 'heart_rate'
+    TABLE_META = 'meta'
+    ANALYSIS_FIELDS = ('splits_km', 'splits_mile', 'best_efforts', 'climbs')
+    SERIES_RESOLUTIONS = (500, 2000)
+    MIGRATIONS = (
+        '_migrate_indexes', '_migrate_activity_summary', '_migrate_speed_series', '_migrate_samples',
+        '_migrate_upload_jobs', '_migrate_rollups', '_migrate_analysis', '_migrate_heart_rate',
+        '_migrate_calories', '_migrate_updated_at', '_migrate_meta', '_migrate_drop_updated_at_index'
+    )
+    PRAGMAS = (
+        'PRAGMA journal_mode=WAL',
+        'PRAGMA synchronous=NORMAL',
+        'PRAGMA cache_size=-16000',
+        'PRAGMA mmap_size=268435456',
+        'PRAGMA temp_store=MEMORY',
+        'PRAGMA busy_timeout=5000',
+    )
+
+    _databases = {}
+    _databases_lock = threading.Lock()
+
+    def __init__(self, storage_path, chunk_size=None):
         self.storage_path = storage_path
-        log.debug("initalizing db connection ot sqlite:///%s", self.storage_path)
-        self._db = dataset.connect('sqlite:///{}'.format(self.storage_path))
+        self.chunk_size = chunk_size or cfg.chunk_size
+        self._db = self._connect(storage_path)
+
+    @classmethod
+    def _set_pragmas(cls, connection, record):
+        cursor = connection.cursor()
+        for pragma in cls.PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
+
+    @classmethod
+    def _connect(cls, storage_path):
+        # a single engine and connection pool per process and database, forked workers build their own
+        key = (os.getpid(), storage_path)
+        with cls._databases_lock:
+            if key not in cls._databases:
+                log.debug("initalizing db connection pool to sqlite:///%s", storage_path)
+                db = dataset.connect(
+                    'sqlite:///{}'.format(storage_path),
+                    engine_kwargs={
+                        'poolclass': sqlalchemy.pool.QueuePool,
+                        'pool_size': cfg.db_pool_size,
+                        'max_overflow': cfg.db_pool_overflow,
+                        'connect_args': {
+                            'check_same_thread': False
+                        }
+                    }
+                )
+                sqlalchemy.event.listen(db.engine, 'connect', cls._set_pragmas)
+                if cfg.metrics:
+                    metrics.instrument_engine(db.engine)
+                cls._databases[key] = db
+            return cls._databases[key]
+
+    @classmethod
+    def dispose(cls):
+        with cls._databases_lock:
+            for db in cls._databases.values():
+                db.close()
+            cls._databases.clear()
+
+    def release(self):
+        # hand the calling thread's connection back to the pool, request threads call it on teardown.
+        # dataset has no public call for this, the per thread connection map it clears is dataset>=2 only
+        self._db._release_connection()
 
     @property
     def db(self):
@@ -51,93 +132,422 @@ class RunnerDB(object):
     def track_points(self):
         return self._db[self.TABLE_TRACK_POINTS]
 
+    @property
+    def imports(self):
+        return self._db[self.TABLE_IMPORTS]
+
+    @property
+    def speed_series(self):
+        return self._db[self.TABLE_SPEED_SERIES]
+
+    @property
+    def samples(self):
+        return self._db[self.TABLE_SAMPLES]
+
+    @property
+    def upload_jobs(self):
+        return self._db[self.TABLE_UPLOAD_JOBS]
+
+    @property
+    def rollups(self):
+        return self._db[self.TABLE_ROLLUPS]
+
+    @property
+    def analysis(self):
+        return self._db[self.TABLE_ANALYSIS]
+
+    @property
+    def heart_rate(self):
+        return self._db[self.TABLE_HEART_RATE]
+
+    @property
+    def meta(self):
+        return self._db[self.TABLE_META]
+
+    def generation(self):
+        # bumped by every write that changes what the pages show, cached responses are keyed on it
+        statement = 'SELECT key, value FROM {}'.format(self.TABLE_META)
+        rows = {row.get('key'): row.get('value') for row in self.db.query(statement)}
+        return rows.get('generation', 0), rows.get('modified', 0)
+
+    def bump_generation(self):
+        with self.db:
+            self.db.query("UPDATE {} SET value = value + 1 WHERE key = 'generation'".format(self.TABLE_META))
+            self.db.query(
+                "UPDATE {} SET value = :now WHERE key = 'modified'".format(self.TABLE_META), now=int(time.time())
+            )
+
+    def _schema_version(self):
+        return next(iter(self.db.query('PRAGMA user_version'))).get('user_version')
+
+    def _migrate_indexes(self):
+        types = self.db.types
+        self.db.create_table(self.TABLE_ACTIVITIES).create_column('activity', types.text)
+        self.activities.create_column('started_at', types.text)
+        self.db.create_table(self.TABLE_TRACK_POINTS).create_column('activity_id', types.integer)
+        self.track_points.create_column('timestamp', types.text)
+        self.db.create_table(self.TABLE_HEART_RATE_VALUES).create_column('activity_id', types.integer)
+        self.db.create_table(self.TABLE_IMPORTS).create_column('path', types.text)
+        # older databases could hold the same activity twice, keep the first copy before enforcing uniqueness
+        self.db.query(
+            'DELETE FROM {0} WHERE id NOT IN (SELECT MIN(id) FROM {0} GROUP BY activity)'.format(self.TABLE_ACTIVITIES)
+        )
+        for table in (self.TABLE_TRACK_POINTS, self.TABLE_HEART_RATE_VALUES):
+            self.db.query(
+                'DELETE FROM {} WHERE activity_id NOT IN (SELECT id FROM {})'.format(table, self.TABLE_ACTIVITIES)
+            )
+        self.db.query(
+            'CREATE UNIQUE INDEX IF NOT EXISTS ix_activities_activity ON {} (activity)'.format(self.TABLE_ACTIVITIES)
+        )
+        self.db.query(
+            'CREATE INDEX IF NOT EXISTS ix_activities_started_at ON {} (started_at)'.format(self.TABLE_ACTIVITIES)
+        )
+        self.db.query(
+            'CREATE INDEX IF NOT EXISTS ix_track_points_activity_id_timestamp ON {} (activity_id, timestamp)'.format(
+                self.TABLE_TRACK_POINTS
+            )
+        )
+        self.db.query(
+            'CREATE INDEX IF NOT EXISTS ix_heart_rate_values_activity_id ON {} (activity_id)'.format(
+                self.TABLE_HEART_RATE_VALUES
+            )
+        )
+        self.db.query('CREATE UNIQUE INDEX IF NOT EXISTS ix_imports_path ON {} (path)'.format(self.TABLE_IMPORTS))
+
+    def _migrate_activity_summary(self):
+        types = self.db.types
+        for column in ('date_label', 'start_time_label', 'duration_label'):
+            self.activities.create_column(column, types.text)
+        self.activities.create_column('calories_estimated', types.boolean)
+        weight = self._get_settings().get('weight')
+        for activity in list(self.activities.all()):
+            data = dict(self._display_fields(activity), id=activity.get('id'), calories_estimated=False)
+            if not activity.get('calories'):
+                data.update({'calories': estimate_calories(weight, activity), 'calories_estimated': True})
+            self.activities.update(data, ['id'])
+
+    def _migrate_speed_series(self):
+        table = self.db.create_table(self.TABLE_SPEED_SERIES)
+        table.create_column('activity_id', self.db.types.integer)
+        table.create_column('points', self.db.types.integer)
+        table.create_column('time', sqlalchemy.LargeBinary)
+        table.create_column('speed', sqlalchemy.LargeBinary)
+        self.db.query(
+            'CREATE UNIQUE INDEX IF NOT EXISTS ix_speed_series_activity_id_points ON {} (activity_id, points)'.format(
+                self.TABLE_SPEED_SERIES
+            )
+        )
+        for activity in list(self.db.query('SELECT id FROM {}'.format(self.TABLE_ACTIVITIES))):
+            statement = 'SELECT distance, timestamp FROM {} WHERE activity_id = :id ORDER BY timestamp'.format(
+                self.TABLE_TRACK_POINTS
+            )
+            points = list(self.db.query(statement, id=activity.get('id')))
+            distance = numpy.array([point.get('distance') for point in points], dtype=numpy.float64)
+            time = to_epoch([point.get('timestamp') for point in points])
+            self._store_speed_series(activity.get('id'), distance, time)
+
+    def _migrate_samples(self):
+        table = self.db.create_table(self.TABLE_SAMPLES)
+        table.create_column('activity_id', self.db.types.integer)
+        for column in samples_to_blobs(to_samples([])):
+            table.create_column(column, sqlalchemy.LargeBinary)
+        self.db.query(
+            'CREATE UNIQUE INDEX IF NOT EXISTS ix_samples_activity_id ON {} (activity_id)'.format(self.TABLE_SAMPLES)
+        )
+        statement = 'SELECT altitude, distance, latitude, longitude, timestamp FROM {} WHERE activity_id = :id ' \
+            'ORDER BY timestamp'.format(self.TABLE_TRACK_POINTS)
+        for activity in list(self.db.query('SELECT id FROM {}'.format(self.TABLE_ACTIVITIES))):
+            track_points = [TrackPoint(**point) for point in self.db.query(statement, id=activity.get('id'))]
+            self._store_samples(activity.get('id'), to_samples(track_points))
+        self.db.query('DROP TABLE IF EXISTS {}'.format(self.TABLE_TRACK_POINTS))
+        return True
+
+    def _migrate_upload_jobs(self):
+        table = self.db.create_table(self.TABLE_UPLOAD_JOBS)
+        for column in ('job', 'state', 'created_at', 'updated_at', 'error'):
+            table.create_column(column, self.db.types.text)
+        table.create_column('activity_id', self.db.types.integer)
+        self.db.query(
+            'CREATE UNIQUE INDEX IF NOT EXISTS ix_upload_jobs_job ON {} (job)'.format(self.TABLE_UPLOAD_JOBS)
+        )
+
+    def _migrate_rollups(self):
+        table = self.db.create_table(self.TABLE_ROLLUPS)
+        for column in ('period', 'period_key', 'period_start'):
+            table.create_column(column, self.db.types.text)
+        table.create_column('count', self.db.types.integer)
+        for column in TOTALS + ('best_pace', ):
+            table.create_column(column, self.db.types.float)
+        self.db.query(
+            'CREATE UNIQUE INDEX IF NOT EXISTS ix_rollups_period_key ON {} (period, period_key)'.format(
+                self.TABLE_ROLLUPS
+            )
+        )
+
+    def _migrate_analysis(self):
+        table = self.db.create_table(self.TABLE_ANALYSIS)
+        table.create_column('activity_id', self.db.types.integer)
+        for column in self.ANALYSIS_FIELDS:
+            table.create_column(column, self.db.types.text)
+        self.db.query(
+            'CREATE UNIQUE INDEX IF NOT EXISTS ix_analysis_activity_id ON {} (activity_id)'.format(self.TABLE_ANALYSIS)
+        )
+        for activity in list(self.db.query('SELECT activity_id FROM {}'.format(self.TABLE_SAMPLES))):
+            self._store_analysis(activity.get('activity_id'), self.load_samples(activity.get('activity_id')))
+
+    def _migrate_heart_rate(self):
+        # heart rate values were stored without time, they can only be aligned when every sample has one
+        table = self.db.create_table(self.TABLE_HEART_RATE)
+        table.create_column('activity_id', self.db.types.integer)
+        table.create_column('histogram', sqlalchemy.LargeBinary)
+        for column in ('hr_seconds', 'heartbeats', 'hr_distance', 'drift'):
+            table.create_column(column, self.db.types.float)
+        self.db.query(
+            'CREATE UNIQUE INDEX IF NOT EXISTS ix_heart_rate_activity_id ON {} (activity_id)'.format(
+                self.TABLE_HEART_RATE
+            )
+        )
+        self.samples.create_column('heart_rate', sqlalchemy.LargeBinary)
+        for column in HR_TOTALS:
+            self.rollups.create_column(column, self.db.types.float)
+        mismatched = 0
+        for activity in list(self.db.query('SELECT activity_id FROM {}'.format(self.TABLE_SAMPLES))):
+            activity_id = activity.get('activity_id')
+            samples = self.load_samples(activity_id)
+            rows = self.heart_rate_values.find(activity_id=activity_id, order_by='id')
+            values = [row.get('value') for row in rows]
+            if values and len(values) != len(samples.time):
+                # readings that cannot be aligned stay in the legacy table instead of being dropped
+                mismatched += 1
+                log.warning(
+                    "keeping %d legacy heart rate values of activity %s, it has %d samples", len(values), activity_id,
+                    len(samples.time)
+                )
+            elif values:
+                samples = samples._replace(heart_rate=numpy.array(values, dtype=SAMPLE_TYPES.heart_rate))
+                self.samples.update(
+                    {
+                        'activity_id': activity_id,
+                        'heart_rate': samples.heart_rate.tobytes()
+                    }, ['activity_id']
+                )
+                self.heart_rate_values.delete(activity_id=activity_id)
+            self._store_heart_rate(activity_id, samples)
+        if mismatched:
+            log.warning(
+                "%s kept with the values of %d activities that do not match their samples",
+                self.TABLE_HEART_RATE_VALUES, mismatched
+            )
+        else:
+            self.db.query('DROP TABLE IF EXISTS {}'.format(self.TABLE_HEART_RATE_VALUES))
+        self.rebuild_rollups()
+        return True
+
+    def _migrate_calories(self):
+        # estimates made from the average pace are redone on the speed series
+        self._update_estimated_calories(self._get_settings().get('weight'))
+        self.rebuild_rollups()
+
+    def _migrate_updated_at(self):
+        self.activities.create_column('updated_at', self.db.types.text)
+        self.db.query(
+            'UPDATE {} SET updated_at = :now'.format(self.TABLE_ACTIVITIES), now=arrow.utcnow().isoformat()
+        )
+
+    def _migrate_meta(self):
+        table = self.db.create_table(self.TABLE_META)
+        table.create_column('key', self.db.types.text)
+        table.create_column('value', self.db.types.bigint)
+        self.db.query('CREATE UNIQUE INDEX IF NOT EXISTS ix_meta_key ON {} (key)'.format(self.TABLE_META))
+        table.insert_many([{'key': 'generation', 'value': 0}, {'key': 'modified', 'value': int(time.time())}])
+
+    def _migrate_drop_updated_at_index(self):
+        # responses are validated on the meta generation, updated_at is only reported by the api
+        self.db.query('DROP INDEX IF EXISTS ix_activities_updated_at')
+
+    def migrate(self):
+        version = self._schema_version()
+        vacuum = False
+        for number, migration in enumerate(self.MIGRATIONS[version:], version + 1):
+            log.info("upgrading db schema to version %d (%s)", number, migration)
+            with self.db:
+                vacuum = getattr(self, migration)() or vacuum
+                self.db.query('PRAGMA user_version = {}'.format(number))
+        if version < len(self.MIGRATIONS):
+            self.bump_generation()
+        if vacuum:
+            log.info("compacting db after schema upgrade")
+            self.db.query('VACUUM')
+        return self._schema_version()
+
     def _find_tcx_files(self, folder):
         for root, _, files in os.walk(folder):
             for name in files:
                 if name.endswith('.tcx'):
-                    yield self._tcx_to_activity(os.path.join(root, name))
-
-    def _tcx_to_activity(self, path):
-        tcx = RunnerTCX(path)
-        tcx_start_date = tcx.activity.Id.text
-        log.debug("found activity tcx file, start_date: %s", tcx_start_date)
-        return Activity(tcx_start_date, tcx)
+                    yield os.path.join(root, name)
+
+    def _tcx_to_activity(self, source):
+        activity = read_activity(source)
+        log.debug("found activity tcx file, start_date: %s", activity.start_date)
+        return activity
+
+    def _display_fields(self, summary):
+        start = arrow.get(summary.get('started_at'))
+        end = arrow.get(summary.get('completed_at'))
+        return {
+            'date_label': start.format('ddd DD MMM YYYY'),
+            'start_time_label': start.format('HH:mm'),
+            'duration_label': format_duration(start, end)
+        }
 
     def _store_activity(self, activity):
-        activity_date = str(activity.tcx.activity.Id.text)
-        if not self.find_activity_by_date(activity_date):
-            json_activity = {
-                'activity': activity_date,
-                'activity_type': activity.tcx.activity_type,
-                'altitude_avg': activity.tcx.altitude_avg,
-                'altitude_max': activity.tcx.altitude_max,
-                'altitude_min': activity.tcx.altitude_min,
-                'altitude_units': 'meters',
-                'ascent': activity.tcx.ascent,
-                'ascent_units': 'meters',
-                'calories': activity.tcx.calories,
-                'completed_at': activity.tcx.completed_at,
-                'descent': activity.tcx.descent,
-                'descent_units': 'meters',
-                'distance': float(activity.tcx.distance),
-                'distance_units': activity.tcx.distance_units,
-                'duration': activity.tcx.duration,
-                'duration_units': 'seconds',
-                'heart_rate_avg': -1,
-                'heart_rate_max': -1,
-                'heart_rate_min': -1,
-                'creator': str(activity.tcx.activity.Creator.Name),
-                'pace': activity.tcx.pace,
-                'pace_hours': sum(int(x) * 60**i
-                                  for i, x in enumerate(reversed(activity.tcx.pace.split(":")))) / 60 / 60,
-                'pace_units': 'mm:ss/km',
-                'started_at': activity.start_date,
-                'start_latitude': activity.tcx.latitude,
-                'start_longitude': activity.tcx.longitude
-            }
-            if activity.tcx.hr_values():
-                json_activity.update(
-                    {
-                        'heart_rate_avg': activity.tcx.hr_avg,
-                        'heart_rate_max': activity.tcx.hr_max,
-                        'heart_rate_min': activity.tcx.hr_min,
-                    }
-                )
-
-            log.info("registering new activity %s", activity_date)
-            return self.activities.insert(json_activity)
+        if not self.find_activity_by_date(activity.start_date):
+            log.info("registering new activity %s", activity.start_date)
+            summary = dict(
+                activity.summary,
+                calories_estimated=not activity.summary.get('calories'),
+                updated_at=arrow.utcnow().isoformat()
+            )
+            summary.update(self._display_fields(summary))
+            if summary['calories_estimated']:
+                samples = activity.samples
+                times, speeds = speed_series(samples.distance, samples.time, self.SERIES_RESOLUTIONS[-1])
+                weight = self._get_settings().get('weight')
+                summary['calories'] = series_calories(weight, summary.get('activity_type'), times, speeds)
+            return self.activities.insert(summary)
         else:
-            log.info("activity %s already registered", activity_date)
+            log.info("activity %s already registered", activity.start_date)
             return 0
 
-    def _store_heart_rate_values(self, activity_id, activity):
-        for value in activity.tcx.hr_values():
-            self.heart_rate_values.insert({'activity_id': activity_id, 'value': value})
+    def _store_heart_rate(self, activity_id, samples):
+        summary = heart_rate_summary(samples)
+        if not summary:
+            return None
+        row = dict(summary, activity_id=activity_id, histogram=summary['histogram'].tobytes())
+        self.heart_rate.insert(row)
+        return row
+
+    def find_heart_rate(self, activity_id):
+        return self.heart_rate.find_one(activity_id=activity_id)
+
+    def _max_heart_rate(self):
+        return max_heart_rate(self._get_settings().get('birth_date'))
 
-    def _store_track_points(self, activity_id, activity):
-        for track in activity.tcx.trackpoints:
-            self.track_points.insert(
+    def _store_samples(self, activity_id, samples):
+        self.samples.insert(dict(samples_to_blobs(samples), activity_id=activity_id))
+
+    def _store_speed_series(self, activity_id, distance, time):
+        rows = []
+        for points in self.SERIES_RESOLUTIONS:
+            times, speeds = speed_series(distance, time, points)
+            rows.append(
                 {
                     'activity_id': activity_id,
-                    'altitude': float(track.AltitudeMeters),
-                    'altitude_units': 'meters',
-                    'distance': float(track.DistanceMeters),
-                    'distance_units': 'meters',
-                    'latitude': float(track.Position.LatitudeDegrees),
-                    'longitude': float(track.Position.LongitudeDegrees),
-                    'timestamp': str(track.Time)
+                    'points': points,
+                    'time': times.tobytes(),
+                    'speed': speeds.tobytes()
                 }
             )
+        self.speed_series.insert_many(rows)
+
+    def _store_analysis(self, activity_id, samples):
+        results = analyze(samples)
+        self.analysis.insert(dict({field: json.dumps(results[field]) for field in results}, activity_id=activity_id))
+
+    def find_analysis(self, activity_id):
+        row = self.analysis.find_one(activity_id=activity_id) or {}
+        return {field: json.loads(row.get(field) or '[]') for field in self.ANALYSIS_FIELDS}
 
     def _query_like(self, table, column, filter):
         statement = 'SELECT * FROM {} WHERE {} LIKE "%{}%"'.format(table, column, filter)
         return self.db.query(statement)
 
-    def _load_activity(self, activity):
-        activity_id = self._store_activity(activity)
+    def _update_rollups(self, activity):
+        # sqlite upsert: the day, week, month and year rows are created or bumped in place
+        statement = (
+            "INSERT INTO {table} (period, period_key, period_start, count, {totals}, best_pace) "
+            "VALUES (:period, :period_key, :period_start, :count, {values}, :best_pace) "
+            "ON CONFLICT (period, period_key) DO UPDATE SET count = count + excluded.count, {updates}, "
+            "best_pace = min(coalesce(best_pace, excluded.best_pace), coalesce(excluded.best_pace, best_pace))"
+        ).format(
+            table=self.TABLE_ROLLUPS,
+            totals=', '.join(SUMS),
+            values=', '.join(':' + total for total in SUMS),
+            updates=', '.join('{0} = {0} + excluded.{0}'.format(total) for total in SUMS)
+        )
+        for row in rollup_rows(activity):
+            self.db.query(statement, **row)
+
+    def rebuild_rollups(self):
+        statement = (
+            'SELECT a.started_at, {totals}, h.histogram, h.hr_seconds, h.heartbeats, h.hr_distance, h.drift '
+            'FROM {activities} a LEFT JOIN {heart_rate} h ON h.activity_id = a.id'
+        ).format(
+            totals=', '.join('a.' + total for total in TOTALS),
+            activities=self.TABLE_ACTIVITIES,
+            heart_rate=self.TABLE_HEART_RATE
+        )
+        max_hr = self._max_heart_rate()
+        with self.db:
+            self.rollups.delete()
+            if self.activities.count():
+                activities = (dict(row, **heart_rate_totals(row, max_hr)) for row in self.db.query(statement))
+                self.rollups.insert_many(rollup(activities), chunk_size=self.chunk_size)
+
+    def find_rollups(self, period, limit=None):
+        statement = 'SELECT * FROM {} WHERE period = :period ORDER BY period_key DESC LIMIT :limit'.format(
+            self.TABLE_ROLLUPS
+        )
+        return list(self.db.query(statement, period=period, limit=-1 if limit is None else limit))
+
+    def _load_activity(self, activity, path=None):
+        # one transaction per activity: samples are written in bulk and a failure rolls back the activity row too
+        with self.db:
+            activity_id = self._store_activity(activity)
+            if activity_id:
+                heart_rate = self._store_heart_rate(activity_id, activity.samples)
+                totals = heart_rate_totals(heart_rate, self._max_heart_rate())
+                self._update_rollups(dict(self.find_activity_by_id(activity_id), **totals))
+                self._store_samples(activity_id, activity.samples)
+                self._store_speed_series(activity_id, activity.samples.distance, activity.samples.time)
+                self._store_analysis(activity_id, activity.samples)
+            if path:
+                self._register_import(path)
+            if activity_id:
+                self.bump_generation()
         if activity_id:
-            self._store_heart_rate_values(activity_id, activity)
-            self._store_track_points(activity_id, activity)
+            map_cache.clear()
+        return activity_id
+
+    def _file_digest(self, path):
+        digest = hashlib.sha1()
+        with open(path, 'rb') as fd:
+            for block in iter(lambda: fd.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _register_import(self, path):
+        stat = os.stat(path)
+        data = {'path': path, 'size': stat.st_size, 'mtime': stat.st_mtime, 'digest': self._file_digest(path)}
+        self.imports.upsert(data, ['path'])
+
+    def _is_imported(self, path, entry):
+        if not entry:
+            return False
+        stat = os.stat(path)
+        if entry.get('size') == stat.st_size and entry.get('mtime') == stat.st_mtime:
+            return True
+        if entry.get('size') != stat.st_size or entry.get('digest') != self._file_digest(path):
+            return False
+        # touched but identical content, remember the new mtime so the next startup skips it on stat alone
+        self.imports.update({'path': path, 'mtime': stat.st_mtime}, ['path'])
+        return True
+
+    def import_index(self):
+        try:
+            return {entry.get('path'): entry for entry in self.imports.all()}
+        except sqlalchemy.exc.OperationalError:
+            return {}
 
     def _get_settings(self):
         return self.settings.find_one(id=0) or {}
@@ -149,6 +559,8 @@ class RunnerDB(object):
         api_key = self._generate_random_api_key()
         data = {'api_key': api_key, 'id': 0}
         self.settings.update(data, ['id'])
+        self.bump_generation()
+        auth_cache.invalidate()
 
     def is_first_run(self):
         try:
@@ -156,26 +568,54 @@ class RunnerDB(object):
         except sqlalchemy.exc.OperationalError:
             return True
 
-    def load_activities(self, folder):
+    def load_activities(self, folder, workers=None, queue_depth=None, backfill=None):
         log.info("loading exitisting activities from folder %s", folder)
-        for activity in self._find_tcx_files(folder):
-            self._load_activity(activity)
+        backfill = backfill or RunnerBackfill(self, workers, queue_depth)
+        return backfill.run(self._find_tcx_files(folder))
 
-    def load_activity_xml(self, xml):
-        with NamedTemporaryFile() as fd:
-            fd.write(xml)
-            activity = self._tcx_to_activity(fd.name)
-            self._load_activity(activity)
+    def load_activity_xml(self, source):
+        # bytes or a readable stream, plain or gzip compressed, parsed without touching the disk
+        activity = self._tcx_to_activity(source)
+        return self._load_activity(activity)
 
     def load_activity(self, path):
         if path.endswith('.tcx'):
             log.info("loading new activity from file %s", path)
             activity = self._tcx_to_activity(path)
-            self._load_activity(activity)
+            return self._load_activity(activity, path)
 
     def find_activity_by_id(self, activity_id):
         return self.activities.find_one(id=activity_id)
 
+    def load_samples(self, activity_id):
+        return samples_from_blobs(self.samples.find_one(activity_id=activity_id))
+
+    def create_upload_job(self, job_id):
+        # spool recovery and the upload request can both register a job, the second insert is a no-op
+        now = arrow.utcnow().isoformat()
+        statement = (
+            "INSERT INTO {} (job, state, created_at, updated_at) VALUES (:job, 'queued', :now, :now) "
+            "ON CONFLICT (job) DO NOTHING".format(self.TABLE_UPLOAD_JOBS)
+        )
+        with self.db:
+            self.db.query(statement, job=job_id, now=now)
+
+    def update_upload_job(self, job_id, **fields):
+        self.upload_jobs.update(dict(fields, job=job_id, updated_at=arrow.utcnow().isoformat()), ['job'])
+
+    def find_upload_job(self, job_id):
+        return self.upload_jobs.find_one(job=job_id)
+
+    def find_speed_series(self, activity_id, points):
+        # the smallest stored resolution that still covers the requested number of points
+        resolution = next((x for x in self.SERIES_RESOLUTIONS if x >= points), self.SERIES_RESOLUTIONS[-1])
+        series = self.speed_series.find_one(activity_id=activity_id, points=resolution)
+        if not series:
+            return numpy.empty(0, dtype=numpy.float64), numpy.empty(0, dtype=numpy.float32)
+        return numpy.frombuffer(series.get('time'), dtype=numpy.float64), numpy.frombuffer(
+            series.get('speed'), dtype=numpy.float32
+        )
+
     def find_activity_by_date(self, activity_date):
         return self.activities.find_one(activity=activity_date)
 
@@ -185,6 +625,18 @@ class RunnerDB(object):
         )
         return self.db.query(statement)
 
+    def find_random_activity(self):
+        # min/max on the rowid are index lookups, picking the next existing id keeps this O(log n) at any history size
+        statement = 'SELECT MIN(id) AS low, MAX(id) AS high FROM {}'.format(self.TABLE_ACTIVITIES)
+        try:
+            bounds = next(iter(self.db.query(statement)))
+        except sqlalchemy.exc.OperationalError:
+            return None
+        if bounds.get('high') is None:
+            return None
+        statement = 'SELECT * FROM {} WHERE id >= :id ORDER BY id LIMIT 1'.format(self.TABLE_ACTIVITIES)
+        return next(iter(self.db.query(statement, id=random.randint(bounds.get('low'), bounds.get('high')))), None)
+
     def find_all_activities(self):
         try:
             statement = 'SELECT * FROM {} WHERE activity LIKE "%" ORDER BY started_at DESC'.format(
@@ -194,11 +646,34 @@ class RunnerDB(object):
         except sqlalchemy.exc.OperationalError:
             return []
 
+    def find_activity_summaries(self, before=None, limit=50):
+        # keyset pagination on the started_at index, display columns are precomputed at ingest
+        statement = (
+            "SELECT id, started_at, date_label, start_time_label, duration_label, "
+            "upper(substr(activity_type, 1, 1)) || substr(activity_type, 2) AS type, "
+            "printf('%.2f km', distance / 1000) AS distance, pace || ' min/km' AS pace, "
+            "printf('%.0f', calories) AS calories FROM {} {} ORDER BY started_at DESC LIMIT :limit"
+        ).format(self.TABLE_ACTIVITIES, 'WHERE started_at < :before' if before else '')
+        try:
+            return list(self.db.query(statement, before=before, limit=limit))
+        except sqlalchemy.exc.OperationalError:
+            return []
+
+    def find_activities_page(self, before=None, limit=50):
+        statement = (
+            "SELECT id, activity, started_at, completed_at, activity_type, distance, duration, pace, calories, "
+            "calories_estimated, ascent, descent, heart_rate_avg, heart_rate_max, updated_at FROM {} {} "
+            "ORDER BY started_at DESC LIMIT :limit"
+        ).format(self.TABLE_ACTIVITIES, 'WHERE started_at < :before' if before else '')
+        try:
+            return list(self.db.query(statement, before=before, limit=limit))
+        except sqlalchemy.exc.OperationalError:
+            return []
+
     def find_past_activities(self, past=7):
-        past = arrow.now().shift(days=-past)
-        for activity in self.find_activities():
-            if past <= arrow.get(activity.get('started_at')):
-                yield activity
+        # started_at is stored as an iso timestamp, so the cutoff is a plain comparison on the indexed column
+        since = arrow.utcnow().shift(days=-past).format('YYYY-MM-DDTHH:mm:ss')
+        return list(self.activities.find(started_at={'>=': since}, order_by='-started_at'))
 
     def update_settings(self, username, birthdate, gender, weight, gmap_apikey, password=None):
         data = {
@@ -220,6 +695,32 @@ class RunnerDB(object):
             api_key = settings.get('api_key')
             data.update({'api_key': api_key})
             self.settings.update(data, ['id'])
+        if settings.get('weight') != weight:
+            self._update_estimated_calories(weight)
+        if settings.get('weight') != weight or settings.get('birth_date') != birthdate:
+            self.rebuild_rollups()
+        self.bump_generation()
+        map_cache.clear()
+        auth_cache.invalidate()
+
+    def _update_estimated_calories(self, weight):
+        if not self.activities.has_column('activity_type'):
+            return
+        statement = 'SELECT id, activity_type FROM {} WHERE calories_estimated'.format(self.TABLE_ACTIVITIES)
+        points = self.SERIES_RESOLUTIONS[-1]
+        with self.db:
+            activities = list(self.db.query(statement))
+            series = [
+                (activity.get('activity_type'), ) + self.find_speed_series(activity.get('id'), points)
+                for activity in activities
+            ]
+            rows = [
+                {
+                    'id': activity.get('id'),
+                    'calories': float(calories)
+                } for activity, calories in zip(activities, batch_calories(weight, series))
+            ]
+            self.activities.update_many(rows, ['id'], chunk_size=self.chunk_size)
 
     def get_gmaps_api_key(self):
         return self._get_settings().get('gmap_apikey')
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import arrow
+import numpy
+
+HR_BINS = 256
+HR_MAX_GAP = 30.0
+HR_MAX_DEFAULT = 190
+ZONES = (0.6, 0.7, 0.8, 0.9)
+ZONE_COLUMNS = ('zone_1', 'zone_2', 'zone_3', 'zone_4', 'zone_5')
+
+
+def max_heart_rate(birth_date, on=None):
+    # Tanaka estimate, 208 - 0.7 * age, the default covers settings saved without a birth date
+    try:
+        birth = arrow.get(birth_date)
+    except (TypeError, ValueError, arrow.parser.ParserError):
+        return HR_MAX_DEFAULT
+    age = ((on or arrow.utcnow()) - birth).days / 365.25
+    return int(round(208 - 0.7 * age))
+
+
+def _intervals(time):
+    # every sample accounts for the time up to the next one, pauses longer than HR_MAX_GAP are not counted
+    return numpy.clip(numpy.append(numpy.diff(time), 0.0), 0.0, HR_MAX_GAP)
+
+
+def heart_rate_summary(samples):
+    heart_rate = numpy.asarray(samples.heart_rate, dtype=numpy.float64)
+    valid = ~numpy.isnan(heart_rate) & (heart_rate > 0)
+    if len(heart_rate) < 2 or not valid.any():
+        return None
+    time = numpy.asarray(samples.time, dtype=numpy.float64)
+    step = _intervals(time)[valid]
+    moved = numpy.append(numpy.diff(numpy.maximum.accumulate(samples.distance.astype(numpy.float64))), 0.0)[valid]
+    moved[step <= 0] = 0.0
+    heart_rate = heart_rate[valid]
+    histogram = numpy.bincount(
+        numpy.clip(heart_rate.astype(numpy.int64), 0, HR_BINS - 1), weights=step, minlength=HR_BINS
+    ).astype(numpy.float32)
+    return {
+        'histogram': histogram,
+        'hr_seconds': float(step.sum()),
+        'heartbeats': float((heart_rate * step).sum() / 60),
+        'hr_distance': float(moved.sum()),
+        'drift': _drift(step, moved, heart_rate)
+    }
+
+
+def _drift(step, moved, heart_rate):
+    # aerobic decoupling: how much the distance covered per heartbeat drops from the first to the second half
+    elapsed = numpy.cumsum(step)
+    if elapsed[-1] <= 0:
+        return None
+    first = elapsed <= elapsed[-1] / 2
+    beats = heart_rate * step
+    halves = [(moved[half].sum(), beats[half].sum()) for half in (first, ~first)]
+    if not all(distance > 0 and count > 0 for distance, count in halves):
+        return None
+    early, late = (distance / count for distance, count in halves)
+    return float((early - late) / early * 100)
+
+
+def zone_times(histogram, max_hr):
+    # seconds spent in each zone, everything below the first boundary belongs to zone 1
+    histogram = numpy.asarray(histogram, dtype=numpy.float64)
+    bounds = numpy.ceil(numpy.array(ZONES) * max_hr).astype(numpy.int64).clip(0, len(histogram))
+    cumulative = numpy.concatenate(([0.0], numpy.cumsum(histogram)))
+    edges = numpy.concatenate(([0], bounds, [len(histogram)]))
+    return numpy.diff(cumulative[edges]).tolist()
+
+
+def efficiency(distance, heartbeats):
+    # meters covered per heartbeat, higher is fitter at the same effort
+    return distance / heartbeats if heartbeats else None
+
+
+def heart_rate_totals(row, max_hr):
+    # the additive heart rate columns of a rollup, zones depend on the max heart rate of the current settings
+    if not row or row.get('histogram') is None:
+        return {}
+    histogram = numpy.frombuffer(row.get('histogram'), dtype=numpy.float32)
+    totals = dict(zip(ZONE_COLUMNS, zone_times(histogram, max_hr)))
+    totals.update({column: row.get(column) or 0 for column in ('hr_seconds', 'heartbeats', 'hr_distance')})
+    if row.get('drift') is not None:
+        totals.update({'drift_total': row.get('drift'), 'drift_count': 1})
+    return totals
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from .tcx import read_activity
+from .config import cfg
+from .metrics import metrics
+
+log = logging.getLogger(__name__)
+
+
+def timed_read_activity(path):
+    # parse time is measured in the worker process and travels back with the activity
+    started = time.perf_counter()
+    activity = read_activity(path)
+    return activity, time.perf_counter() - started
+
+
+class RunnerBackfill(object):
+    SOURCE = 'backfill'
+    PROGRESS_INTERVAL = 5
+
+    def __init__(self, db, workers=None, queue_depth=None):
+        self.db = db
+        self.workers = workers or cfg.workers or os.cpu_count() or 1
+        self.queue_depth = queue_depth or cfg.queue_depth or self.workers * 2
+        self.total = 0
+        self.skipped = 0
+        self.parsed = 0
+        self.imported = 0
+        self.failed = 0
+        self.started = None
+        self.finished = None
+        self.last_progress = None
+
+    def _log_progress(self, force=False):
+        now = time.time()
+        if not force and now - self.last_progress < self.PROGRESS_INTERVAL:
+            return
+        self.last_progress = now
+        elapsed = max(now - self.started, 1e-6)
+        log.info(
+            "backfill progress: %d/%d files parsed, %d imported, %d failed, %.1f files/s", self.parsed, self.total,
+            self.imported, self.failed, self.parsed / elapsed
+        )
+
+    def progress(self):
+        return {
+            'running': self.started is not None and self.finished is None,
+            'total': self.total,
+            'skipped': self.skipped,
+            'parsed': self.parsed,
+            'imported': self.imported,
+            'failed': self.failed,
+            'elapsed': round((self.finished or time.time()) - self.started, 3) if self.started else 0
+        }
+
+    def _write(self, path, activity, seconds):
+        self.parsed += 1
+        metrics.parsed(self.SOURCE, activity, seconds)
+        started = time.perf_counter()
+        try:
+            imported = self.db._load_activity(activity, path)
+        except Exception:
+            self.failed += 1
+            metrics.failed(self.SOURCE, 'write')
+            log.exception("unable to store activity from file %s", path)
+        else:
+            if imported:
+                self.imported += 1
+            metrics.written(self.SOURCE, imported, time.perf_counter() - started)
+        self._log_progress()
+
+    def _parse_failed(self, path):
+        self.parsed += 1
+        self.failed += 1
+        metrics.failed(self.SOURCE, 'parse')
+        log.exception("unable to parse activity file %s", path)
+
+    def _collect(self, done):
+        for future, path in done.items():
+            try:
+                activity, seconds = future.result()
+            except BrokenProcessPool:
+                raise
+            except Exception:
+                self._parse_failed(path)
+                continue
+            self._write(path, activity, seconds)
+
+    def _run_serial(self, paths):
+        for path in paths:
+            try:
+                activity, seconds = timed_read_activity(path)
+            except Exception:
+                self._parse_failed(path)
+                continue
+            self._write(path, activity, seconds)
+
+    def _run_pool(self, paths):
+        # workers only parse, this process is the single writer so sqlite never sees concurrent inserts
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as pool:
+            pending = {}
+            for path in paths:
+                if len(pending) >= self.queue_depth:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    self._collect({future: pending.pop(future) for future in done})
+                pending[pool.submit(timed_read_activity, path)] = path
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                self._collect({future: pending.pop(future) for future in done})
+
+    def _changed(self, paths):
+        index = self.db.import_index()
+        for path in paths:
+            if self.db._is_imported(path, index.get(path)):
+                self.skipped += 1
+            else:
+                yield path
+
+    def run(self, paths):
+        self.started = self.last_progress = time.time()
+        paths = list(self._changed(paths))
+        self.total = len(paths)
+        log.info(
+            "backfilling %d activity files (%d unchanged), workers: %d, queue depth: %d", self.total, self.skipped,
+            self.workers, self.queue_depth
+        )
+        if self.workers > 1 and self.total > 1:
+            self._run_pool(paths)
+        elif paths:
+            self._run_serial(paths)
+        self.finished = time.time()
+        log.info(
+            "backfill completed in %.1fs: %d files skipped, %d imported, %d failed", self.finished - self.started,
+            self.skipped, self.imported, self.failed
+        )
+        return self.imported
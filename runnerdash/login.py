@@ -1,11 +1,14 @@
 # -*- coding: utf-8 -*-
+import hmac
+import hashlib
 from functools import wraps
 
 from flask import request, abort
-from flask_login import LoginManager, UserMixin
+from flask_login import LoginManager, UserMixin, current_user
 
 from .config import cfg
 from .db import RunnerDB
+from .cache import auth_cache
 
 login_manager = LoginManager()
 
@@ -16,21 +19,55 @@ class User(UserMixin):
         self.id = id
 
 
+def _digest(key):
+    return hashlib.sha256(key.encode()).digest()
+
+
+def _load_user(id):
+    user = RunnerDB(cfg.db_file).find_user_by_id(id)
+    return User(user.get('username'), id) if user else None
+
+
+def _load_api_key_digests():
+    return frozenset(_digest(key) for key in RunnerDB(cfg.db_file).find_all_api_keys() if key)
+
+
+def _generation():
+    # invalidate() only reaches this process, the db generation also covers writes made by other workers
+    return RunnerDB(cfg.db_file).generation()[0]
+
+
 @login_manager.user_loader
 def user_loader_callback(id):
-    db = RunnerDB(cfg.db_file)
-    user = db.find_user_by_id(id)
-    return User(user.get('username'), id)
+    return auth_cache.get(('user', str(id)), lambda: _load_user(id), _generation())
+
+
+def _valid_api_key():
+    key = request.headers.get('x-api-key')
+    if not key:
+        return False
+    digest = _digest(key)
+    known_digests = auth_cache.get('api_keys', _load_api_key_digests, _generation())
+    # compare every known digest so the response time does not depend on which key matched
+    return any([hmac.compare_digest(digest, known) for known in known_digests])
 
 
 def apikey_required(view_function):
     @wraps(view_function)
     def decorated_function(*args, **kwargs):
-        db = RunnerDB(cfg.db_file)
-        keys = db.find_all_api_keys()
-        for key in keys:
-            if request.headers.get('x-api-key') and request.headers.get('x-api-key') == key:
-                return view_function(*args, **kwargs)
+        if _valid_api_key():
+            return view_function(*args, **kwargs)
+        abort(401)
+
+    return decorated_function
+
+
+def login_or_apikey_required(view_function):
+    # data endpoints are read by the pages of a logged in user and by scripts holding an api key
+    @wraps(view_function)
+    def decorated_function(*args, **kwargs):
+        if current_user.is_authenticated or _valid_api_key():
+            return view_function(*args, **kwargs)
         abort(401)
 
     return decorated_function
@@ -1,11 +1,34 @@
 # -*- coding: utf-8 -*-
+import json
 import logging
 
+from markupsafe import Markup
 from flask_googlemaps import Map, icons
 
 log = logging.getLogger(__name__)
 
 
+class RunnerPathMap(Map):
+    # polylines are shipped as a google encoded path and decoded in the browser once the map exists
+    SCRIPT = (
+        '<script type="text/javascript">'
+        'google.maps.event.addDomListener(window, "load", function() {{'
+        '{0}_polylines[0].setPath(decodePolyline({1}));'
+        '}});'
+        '</script>'
+    )
+
+    def __init__(self, encoded_path=None, **kwargs):
+        super().__init__(**kwargs)
+        self.encoded_path = encoded_path
+
+    @property
+    def js(self):
+        if self.encoded_path is None:
+            return super().js
+        return super().js + Markup(self.SCRIPT.format(self.varname, json.dumps(self.encoded_path)))
+
+
 class RunnerMap(object):
     STYLE = (
         "height:{0};"
@@ -25,6 +48,7 @@ class RunnerMap(object):
         lng,
         zoom=16,
         path=[],
+        encoded_path=None,
         markers={},
         height="100%",
         width="100%",
@@ -40,7 +64,8 @@ class RunnerMap(object):
             map_markers[getattr(icons.dots, marker['color'])] = [
                 (marker['lat'], marker['lng'], "<b style='color:{};'>{}</b>".format(marker['color'], marker['label']))
             ]
-        return Map(
+        return RunnerPathMap(
+            encoded_path=encoded_path,
             identifier=name,
             varname=name,
             lat=lat,
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import cProfile
+import logging
+import threading
+
+import sqlalchemy
+from flask import request
+
+from .utils import make_dirs
+from .config import cfg
+
+log = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+PROFILE_DIR = 'profiles'
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for value in values)
+    return '{' + ','.join('{}="{}"'.format(name, value) for name, value in zip(names, escaped)) + '}'
+
+
+class Counter(object):
+    TYPE = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, amount=1, *labels):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in sorted(self.values.items()):
+            yield '{}{} {}'.format(self.name, _labels(self.labels, labels), value)
+
+
+class Histogram(Counter):
+    TYPE = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value, *labels):
+        # per label set: one count per bucket, the sum and the total count
+        counts, total, count = self.values.get(labels, ([0] * len(self.buckets), 0, 0))
+        for number, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[number] += 1
+        self.values[labels] = (counts, total + value, count + 1)
+
+    def samples(self):
+        for labels, (counts, total, count) in sorted(self.values.items()):
+            for bound, bucket in zip(self.buckets + ('+Inf', ), counts + [count]):
+                yield '{}_bucket{} {}'.format(self.name, _labels(self.labels + ('le', ), labels + (bound, )), bucket)
+            yield '{}_sum{} {}'.format(self.name, _labels(self.labels, labels), total)
+            yield '{}_count{} {}'.format(self.name, _labels(self.labels, labels), count)
+
+
+class RunnerMetrics(object):
+    # process wide counters in the prometheus text format, requests and sql are only timed once enabled
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.profile_lock = threading.Lock()
+        self.request_seconds = Histogram(
+            'runnerdash_request_duration_seconds', 'Time spent handling a request', ('view', 'method', 'status')
+        )
+        self.request_queries = Histogram(
+            'runnerdash_request_sql_queries', 'SQL statements executed per request', ('view', ), QUERY_BUCKETS
+        )
+        self.request_sql_seconds = Histogram(
+            'runnerdash_request_sql_duration_seconds', 'Time spent in SQL statements per request', ('view', )
+        )
+        self.sql_queries = Counter('runnerdash_sql_queries_total', 'SQL statements executed')
+        self.sql_seconds = Counter('runnerdash_sql_duration_seconds_total', 'Time spent in SQL statements')
+        self.ingest_files = Counter('runnerdash_ingest_files_total', 'Activity files parsed', ('source', ))
+        self.ingest_failures = Counter(
+            'runnerdash_ingest_failures_total', 'Activity files that failed to parse or store', ('source', 'stage')
+        )
+        self.ingest_imported = Counter('runnerdash_ingest_activities_total', 'New activities stored', ('source', ))
+        self.ingest_trackpoints = Counter(
+            'runnerdash_ingest_trackpoints_total', 'Trackpoints parsed, divide by the parse time for trackpoints/s',
+            ('source', )
+        )
+        self.ingest_parse_seconds = Counter(
+            'runnerdash_ingest_parse_seconds_total', 'Time spent parsing activity files', ('source', )
+        )
+        self.ingest_write_seconds = Counter(
+            'runnerdash_ingest_write_seconds_total', 'Time spent storing parsed activities', ('source', )
+        )
+        self.metrics = (
+            self.request_seconds, self.request_queries, self.request_sql_seconds, self.sql_queries, self.sql_seconds,
+            self.ingest_files, self.ingest_failures, self.ingest_imported, self.ingest_trackpoints,
+            self.ingest_parse_seconds, self.ingest_write_seconds
+        )
+
+    def parsed(self, source, activity, seconds):
+        with self.lock:
+            self.ingest_files.inc(1, source)
+            self.ingest_trackpoints.inc(len(activity.samples.time), source)
+            self.ingest_parse_seconds.inc(seconds, source)
+
+    def written(self, source, imported, seconds):
+        with self.lock:
+            self.ingest_write_seconds.inc(seconds, source)
+            if imported:
+                self.ingest_imported.inc(1, source)
+
+    def failed(self, source, stage):
+        with self.lock:
+            self.ingest_failures.inc(1, source, stage)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info['query_started'].pop()
+        with self.lock:
+            self.sql_queries.inc()
+            self.sql_seconds.inc(seconds)
+        if getattr(self.local, 'started', None) is not None:
+            self.local.queries += 1
+            self.local.sql_seconds += seconds
+
+    def instrument_engine(self, engine):
+        sqlalchemy.event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        sqlalchemy.event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def _before_request(self):
+        self.local.started = time.perf_counter()
+        self.local.queries = 0
+        self.local.sql_seconds = 0.0
+        self.local.profiler = None
+        # one profiled request at a time, concurrent requests are served without the profiler
+        if cfg.profile and self.profile_lock.acquire(blocking=False):
+            self.local.profiler = cProfile.Profile()
+            self.local.profiler.enable()
+
+    def _stop_profiler(self, seconds=None):
+        profiler, self.local.profiler = getattr(self.local, 'profiler', None), None
+        if profiler is None:
+            return
+        profiler.disable()
+        self.profile_lock.release()
+        if seconds is None or seconds < cfg.profile_threshold:
+            return
+        profile_path = os.path.join(cfg.base_path, PROFILE_DIR)
+        make_dirs(profile_path)
+        path = os.path.join(
+            profile_path, '{}-{}-{}ms.prof'.format(
+                time.strftime('%Y%m%d-%H%M%S'), request.endpoint or 'none', int(seconds * 1000)
+            )
+        )
+        profiler.dump_stats(path)
+        log.warning("slow request %s %s took %.3fs, profile written to %s", request.method, request.path, seconds, path)
+
+    def _after_request(self, response):
+        started, self.local.started = getattr(self.local, 'started', None), None
+        if started is None:
+            return response
+        seconds = time.perf_counter() - started
+        view = request.endpoint or 'none'
+        with self.lock:
+            self.request_seconds.observe(seconds, view, request.method, response.status_code)
+            self.request_queries.observe(self.local.queries, view)
+            self.request_sql_seconds.observe(self.local.sql_seconds, view)
+        self._stop_profiler(seconds)
+        return response
+
+    def _teardown_request(self, exception=None):
+        # requests that never reached after_request still hand the profiler back
+        self.local.started = None
+        self._stop_profiler()
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for metric in self.metrics:
+                lines.append('# HELP {} {}'.format(metric.name, metric.help))
+                lines.append('# TYPE {} {}'.format(metric.name, metric.TYPE))
+                lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+metrics = RunnerMetrics()
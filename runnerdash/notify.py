@@ -1,10 +1,16 @@
 # -*- coding: utf-8 -*-
 import os
+import time
+import queue
 import logging
+import threading
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
 from .db import RunnerDB
+from .ingest import RunnerBackfill, timed_read_activity
+from .metrics import metrics
+from .status import status
 from .utils import make_dirs
 from .config import cfg
 
@@ -12,32 +18,169 @@ log = logging.getLogger(__name__)
 
 
 class RunnerFileHandler(FileSystemEventHandler):
-    def __init__(self, base_path):
-        db = RunnerDB(cfg.db_file)
-        db.load_activities(base_path)
+    def __init__(self, notify):
+        self.notify = notify
 
     def on_created(self, event):
-        path = event.src_path
-        log.debug('new file creation event raised, path: %s', path)
-        db = RunnerDB(cfg.db_file)
-        db.load_activity(path)
+        if not event.is_directory:
+            self.notify.touch(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.notify.touch(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.notify.touch(event.dest_path)
 
 
 class RunnerNotify(object):
     WATCH_DIR = 'activities'
+    SOURCE = 'notify'
 
     def __init__(self):
         self.base_path = os.path.join(cfg.base_path, self.WATCH_DIR)
-        self.event_handler = RunnerFileHandler(self.base_path)
+        self.event_handler = RunnerFileHandler(self)
         self.observer = Observer()
+        self.debounce = cfg.notify_debounce
+        self.batch_size = cfg.notify_batch_size
+        self.retries = cfg.notify_retries
+        self.queue = queue.Queue(maxsize=cfg.notify_queue_size)
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.attempts = {}
+        self.scanned = threading.Event()
+        self.stopping = threading.Event()
+        self.threads = []
+
+    def touch(self, path):
+        # runs on the observer thread: only record the event, the debouncer decides when the file is complete
+        if not path.endswith('.tcx'):
+            return
+        log.debug('file event raised, path: %s', path)
+        with self.lock:
+            self.pending[path] = (time.time(), None)
+
+    def _stat(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime
+
+    def _stable(self, now):
+        ready = []
+        with self.lock:
+            for path, (seen, previous) in list(self.pending.items()):
+                if now - seen < self.debounce:
+                    continue
+                current = self._stat(path)
+                if current is None:
+                    del self.pending[path]
+                elif current == previous:
+                    del self.pending[path]
+                    ready.append(path)
+                else:
+                    self.pending[path] = (now, current)
+        return ready
+
+    def _debounce(self):
+        while not self.stopping.wait(self.debounce / 2):
+            for path in self._stable(time.time()):
+                self.queue.put(path)
+
+    def _retry(self, path):
+        attempts = self.attempts.get(path, 0) + 1
+        if attempts > self.retries:
+            self.attempts.pop(path, None)
+            metrics.failed(self.SOURCE, 'parse')
+            log.exception("unable to load activity file %s after %d attempts", path, attempts)
+            return
+        self.attempts[path] = attempts
+        log.debug("activity file %s is not readable yet, retry %d/%d", path, attempts, self.retries)
+        with self.lock:
+            self.pending.setdefault(path, (time.time(), None))
+
+    def _batch(self):
+        paths = [self.queue.get()]
+        while len(paths) < self.batch_size:
+            try:
+                paths.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return paths
+
+    def _ingest(self, db, paths):
+        index = db.import_index()
+        loaded = 0
+        for path in sorted(set(paths)):
+            try:
+                if not os.path.exists(path) or db._is_imported(path, index.get(path)):
+                    continue
+                activity, seconds = timed_read_activity(path)
+            except Exception:
+                self._retry(path)
+                continue
+            self.attempts.pop(path, None)
+            metrics.parsed(self.SOURCE, activity, seconds)
+            started = time.perf_counter()
+            try:
+                imported = db._load_activity(activity, path)
+            except Exception:
+                metrics.failed(self.SOURCE, 'write')
+                log.exception("unable to store activity from file %s", path)
+                continue
+            metrics.written(self.SOURCE, imported, time.perf_counter() - started)
+            if imported:
+                loaded += 1
+        log.info("loaded %d new activities from a batch of %d files", loaded, len(paths))
+
+    def _work(self):
+        # events queued while the initial scan runs are handled once it is over, it may import the same files
+        self.scanned.wait()
+        while True:
+            paths = self._batch()
+            if None in paths:
+                break
+            db = RunnerDB(cfg.db_file)
+            try:
+                self._ingest(db, paths)
+            finally:
+                db.release()
+
+    def _scan(self):
+        db = RunnerDB(cfg.db_file)
+        status.backfill = RunnerBackfill(db)
+        try:
+            db.load_activities(self.base_path, backfill=status.backfill)
+        except Exception:
+            log.exception("initial scan of %s failed", self.base_path)
+        finally:
+            db.release()
+            self.scanned.set()
+            status.set_phase('ready')
+
+    def _spawn(self, target, name):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        return thread
 
     def start(self):
         make_dirs(self.base_path)
         self.observer.schedule(self.event_handler, path=self.base_path, recursive=False)
         self.observer.start()
+        self._spawn(self._scan, 'notify-scan')
+        self.threads = [self._spawn(self._debounce, 'notify-debounce'), self._spawn(self._work, 'notify-worker')]
         log.info("started filesystem notifier, base_path: %s", self.base_path)
 
     def stop(self):
         self.observer.stop()
         self.observer.join()
+        self.stopping.set()
+        if self.scanned.is_set():
+            # the worker is draining the queue, so neither the debouncer nor the sentinel can block here
+            self.threads[0].join()
+            self.queue.put(None)
+            self.threads[1].join()
+        self.threads = []
         log.info("stopped filesystem notifier, base_path: %s", self.base_path)
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import math
+
+import numpy
+
+EARTH_RADIUS = 6371008.8
+# ground resolution of a single pixel at zoom level 0 on the equator
+EQUATOR_METERS_PER_PIXEL = 156543.03392
+
+
+def zoom_tolerance(latitude, zoom, pixels=1.0):
+    return EQUATOR_METERS_PER_PIXEL * math.cos(math.radians(latitude)) / 2**zoom * pixels
+
+
+def simplify(latitude, longitude, tolerance):
+    # iterative douglas-peucker over an equirectangular projection in meters, returns the indexes to keep
+    size = len(latitude)
+    if size < 3:
+        return numpy.arange(size)
+    x = numpy.radians(longitude) * math.cos(math.radians(float(numpy.mean(latitude)))) * EARTH_RADIUS
+    y = numpy.radians(latitude) * EARTH_RADIUS
+    keep = numpy.zeros(size, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, size - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        px, py = x[start + 1:end] - x[start], y[start + 1:end] - y[start]
+        length = math.hypot(dx, dy)
+        if length:
+            distances = numpy.abs(px * dy - py * dx) / length
+        else:
+            distances = numpy.hypot(px, py)
+        index = int(numpy.argmax(distances))
+        if distances[index] > tolerance:
+            middle = start + 1 + index
+            keep[middle] = True
+            stack.append((start, middle))
+            stack.append((middle, end))
+    return numpy.flatnonzero(keep)
+
+
+def encode(latitude, longitude, precision=5):
+    # google encoded polyline algorithm format
+    coordinates = numpy.round(numpy.column_stack((latitude, longitude)) * 10**precision).astype(numpy.int64)
+    deltas = numpy.diff(coordinates, axis=0, prepend=numpy.zeros((1, 2), dtype=numpy.int64)).ravel()
+    chunks = []
+    for value in deltas.tolist():
+        value = ~(value << 1) if value < 0 else value << 1
+        while value >= 0x20:
+            chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        chunks.append(chr(value + 63))
+    return ''.join(chunks)
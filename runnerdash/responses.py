@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+import json
+import zlib
+import hashlib
+import logging
+from datetime import datetime, timezone
+from functools import wraps
+
+import numpy
+from flask import Response, request, stream_with_context, make_response
+from flask_login import current_user
+from werkzeug.http import is_resource_modified
+
+from .db import RunnerDB
+from .config import cfg
+from .cache import response_cache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+log = logging.getLogger(__name__)
+
+CHUNK_ITEMS = 1000
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def make_etag(*parts):
+    return hashlib.sha1(json.dumps(parts, default=str).encode()).hexdigest()
+
+
+def _array_items(values):
+    # NaN is not valid json, missing samples go out as null
+    if isinstance(values, numpy.ndarray):
+        if values.dtype.kind == 'f' and numpy.isnan(values).any():
+            return numpy.where(numpy.isnan(values), None, values.astype(numpy.float64)).tolist()
+        return values.tolist()
+    return values
+
+
+def json_chunks(value):
+    # long lists go out a slice at a time so the body is never rendered as a single string
+    if isinstance(value, dict):
+        yield '{'
+        for number, (key, item) in enumerate(value.items()):
+            yield '{}{}:'.format(',' if number else '', json.dumps(key))
+            yield from json_chunks(item)
+        yield '}'
+    elif isinstance(value, (list, tuple, numpy.ndarray)):
+        values = _array_items(value)
+        yield '['
+        for start in range(0, len(values), CHUNK_ITEMS):
+            chunk = values[start:start + CHUNK_ITEMS]
+            if chunk and isinstance(chunk[0], dict):
+                body = ','.join(''.join(json_chunks(item)) for item in chunk)
+            else:
+                body = json.dumps(chunk)[1:-1]
+            yield (',' if start else '') + body
+        yield ']'
+    else:
+        yield json.dumps(value.item() if isinstance(value, numpy.generic) else value)
+
+
+def _encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def _compress(chunks, encoding):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        process, finish = compressor.process, compressor.finish
+    elif encoding == 'gzip':
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        process, finish = compressor.compress, compressor.flush
+    else:
+        for chunk in chunks:
+            yield chunk.encode()
+        return
+    for chunk in chunks:
+        data = process(chunk.encode())
+        if data:
+            yield data
+    yield finish()
+
+
+def _validate(response, etag, last_modified):
+    if etag:
+        response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    # cached by the browser but always revalidated, which is a cheap 304 when nothing changed
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def not_modified(etag=None, last_modified=None):
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+    return _validate(Response(status=304), etag, last_modified)
+
+
+def streamed_json(value):
+    encoding = _encoding()
+    response = Response(stream_with_context(_compress(json_chunks(value), encoding)), mimetype='application/json')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def cached_response(view_function):
+    # GET responses are kept per user and data generation, any ingest or settings write starts a new generation
+    @wraps(view_function)
+    def decorated_function(*args, **kwargs):
+        if request.method != 'GET':
+            return view_function(*args, **kwargs)
+        generation, modified = RunnerDB(cfg.db_file).generation()
+        key = (
+            current_user.get_id() if current_user.is_authenticated else 'apikey', generation, request.full_path,
+            request.headers.get('Accept-Encoding', '')
+        )
+        etag = make_etag(*key)
+        last_modified = datetime.fromtimestamp(modified, timezone.utc)
+        response = not_modified(etag, last_modified)
+        if response:
+            return response
+        cached = response_cache.get(key)
+        if cached is None:
+            response = make_response(view_function(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            if response.is_streamed:
+                # keeping the body would read the whole generator, streamed json is only revalidated
+                response.vary.add('Cookie')
+                return _validate(response, etag, last_modified)
+            cached = (response.get_data(), response.mimetype, response.headers.get('Content-Encoding'))
+            response_cache.set(key, cached)
+        body, mimetype, encoding = cached
+        response = Response(body, mimetype=mimetype)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.update(('Cookie', 'Accept-Encoding'))
+        return _validate(response, etag, last_modified)
+
+    return decorated_function
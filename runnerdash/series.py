@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+from collections import namedtuple
+
+import arrow
+import numpy
+
+Samples = namedtuple('Samples', ['time', 'latitude', 'longitude', 'altitude', 'distance', 'heart_rate'])
+SAMPLE_TYPES = Samples(numpy.float64, numpy.float64, numpy.float64, numpy.float32, numpy.float32, numpy.float32)
+
+
+def _is_utc(timestamp):
+    return timestamp.endswith('Z') or ('+' not in timestamp and timestamp.count('-') == 2)
+
+
+def to_epoch(timestamps):
+    # numpy parses the utc timestamps written by RunnerUp, anything carrying an offset goes through arrow
+    if all(_is_utc(timestamp) for timestamp in timestamps):
+        try:
+            values = numpy.array([timestamp.rstrip('Z') for timestamp in timestamps], dtype='datetime64[ms]')
+            return values.astype(numpy.int64) / 1000.0
+        except ValueError:
+            pass
+    return numpy.array([arrow.get(timestamp).float_timestamp for timestamp in timestamps], dtype=numpy.float64)
+
+
+def speed_series(distance, time, points):
+    # average km/h over evenly spaced windows, each labelled with the time the window ends
+    size = len(distance)
+    if size < 2:
+        return numpy.empty(0, dtype=numpy.float64), numpy.empty(0, dtype=numpy.float32)
+    index = numpy.unique(numpy.linspace(0, size - 1, min(points, size - 1) + 1).astype(numpy.int64))
+    distances = numpy.diff(distance[index])
+    times = numpy.diff(time[index])
+    valid = times > 0
+    speeds = distances[valid] / times[valid] * 3.6
+    return time[index[1:]][valid], speeds.astype(numpy.float32)
+
+
+def to_samples(track_points):
+    time = to_epoch([track.timestamp for track in track_points]) if track_points else []
+    return Samples(
+        numpy.asarray(time, dtype=SAMPLE_TYPES.time),
+        numpy.array([track.latitude for track in track_points], dtype=SAMPLE_TYPES.latitude),
+        numpy.array([track.longitude for track in track_points], dtype=SAMPLE_TYPES.longitude),
+        numpy.array(
+            [numpy.nan if track.altitude is None else track.altitude for track in track_points],
+            dtype=SAMPLE_TYPES.altitude
+        ),
+        numpy.array([track.distance for track in track_points], dtype=SAMPLE_TYPES.distance),
+        numpy.array(
+            [numpy.nan if track.heart_rate is None else track.heart_rate for track in track_points],
+            dtype=SAMPLE_TYPES.heart_rate
+        ),
+    )
+
+
+def samples_to_blobs(samples):
+    return {name: column.tobytes() for name, column in samples._asdict().items()}
+
+
+def samples_from_blobs(row):
+    if not row:
+        return Samples(*(numpy.empty(0, dtype=dtype) for dtype in SAMPLE_TYPES))
+    # columns added after an activity was stored read back as missing values
+    size = len(row.get('time')) // numpy.dtype(SAMPLE_TYPES.time).itemsize
+    return Samples(
+        *(
+            numpy.full(size, numpy.nan, dtype) if row.get(name) is None else numpy.frombuffer(row.get(name), dtype)
+            for name, dtype in SAMPLE_TYPES._asdict().items()
+        )
+    )
@@ -8,6 +8,27 @@ window.chartColors = {
 	grey: 'rgb(201, 203, 207)'
 };
 
+// google encoded polyline decoder, map paths are shipped encoded
+function decodePolyline(encoded) {
+    var points = [];
+    var index = 0, lat = 0, lng = 0;
+    var decodeValue = function() {
+        var result = 0, shift = 0, value;
+        do {
+            value = encoded.charCodeAt(index++) - 63;
+            result |= (value & 0x1f) << shift;
+            shift += 5;
+        } while (value >= 0x20);
+        return (result & 1) ? ~(result >> 1) : (result >> 1);
+    };
+    while (index < encoded.length) {
+        lat += decodeValue();
+        lng += decodeValue();
+        points.push({lat: lat / 1e5, lng: lng / 1e5});
+    }
+    return points;
+}
+
 // speed dashboard
 function speedDashboard(timestamps, speeds) {
     var data = {
@@ -71,6 +92,51 @@ function speedDashboard(timestamps, speeds) {
     });
 }
 
+// speed dashboard from the data api, times are utc epoch seconds
+function loadSpeedDashboard(url) {
+    $.getJSON(url, function(data) {
+        var timestamps = data.time.map(function(time) {
+            return new Date(time * 1000).toISOString().substr(11, 5);
+        });
+        speedDashboard(timestamps, data.speed);
+    });
+}
+
+// statistics trends, one bar per rollup period
+function rollupChart(canvas, labels, values, label) {
+    var chart = document.getElementById(canvas).getContext("2d");
+    new Chart(chart, {
+      type: "bar",
+      data: {
+        labels: labels,
+        datasets: [{
+          label: label,
+          backgroundColor: window.chartColors.green,
+          borderColor: window.chartColors.green,
+          data: values
+        }]
+      },
+      options: {
+        legend: {
+          display: false
+        },
+        scales: {
+          yAxes: [{
+            scaleLabel: {
+              display: true,
+              labelString: label
+            },
+            ticks: {
+              beginAtZero: true
+            }
+          }]
+        },
+        responsive: true,
+        maintainAspectRatio: false
+      }
+    });
+}
+
 $(document).ready(function($) {
   $(".clickable-row").click(function() {
     $("#activity-id").val($(this).data("activity"));
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import arrow
+
+from .heartrate import ZONE_COLUMNS
+
+PERIODS = ('day', 'week', 'month', 'year')
+TOTALS = ('distance', 'duration', 'calories', 'ascent')
+HR_TOTALS = ('hr_seconds', 'heartbeats', 'hr_distance') + ZONE_COLUMNS + ('drift_total', 'drift_count')
+SUMS = TOTALS + HR_TOTALS
+
+
+def period_keys(started_at):
+    # periods follow the activity own clock, like the date labels shown in the activity list
+    start = arrow.get(started_at)
+    year, week, weekday = start.isocalendar()
+    monday = start.shift(days=1 - weekday)
+    return (
+        ('day', start.format('YYYY-MM-DD'), start.format('YYYY-MM-DD')),
+        ('week', '{}-W{:02d}'.format(year, week), monday.format('YYYY-MM-DD')),
+        ('month', start.format('YYYY-MM'), start.format('YYYY-MM-01')),
+        ('year', start.format('YYYY'), start.format('YYYY-01-01')),
+    )
+
+
+def best_pace(activity):
+    # seconds per km, None when the activity did not cover any distance
+    distance = activity.get('distance') or 0
+    duration = activity.get('duration') or 0
+    if distance <= 0 or duration <= 0:
+        return None
+    return duration / (distance / 1000)
+
+
+def rollup_rows(activity):
+    values = {total: activity.get(total) or 0 for total in SUMS}
+    pace = best_pace(activity)
+    for period, key, start in period_keys(activity.get('started_at')):
+        yield dict(values, period=period, period_key=key, period_start=start, count=1, best_pace=pace)
+
+
+def rollup(activities):
+    rollups = {}
+    for activity in activities:
+        for row in rollup_rows(activity):
+            key = (row['period'], row['period_key'])
+            current = rollups.get(key)
+            if current is None:
+                rollups[key] = row
+                continue
+            current['count'] += 1
+            for total in SUMS:
+                current[total] += row[total]
+            paces = [pace for pace in (current['best_pace'], row['best_pace']) if pace is not None]
+            current['best_pace'] = min(paces) if paces else None
+    return list(rollups.values())
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class RunnerStatus(object):
+    # the server binds inside waitress or werkzeug, no phase claims it before the backfill starts
+    PHASES = ('starting', 'database', 'backfill', 'ready')
+
+    def __init__(self):
+        self.started = self.since = time.time()
+        self.phase = self.PHASES[0]
+        self.timings = {}
+        self.backfill = None
+
+    def set_phase(self, phase):
+        now = time.time()
+        self.timings[self.phase] = round(now - self.since, 3)
+        self.since = now
+        log.info("startup phase %s completed in %.2fs, entering %s", self.phase, self.timings[self.phase], phase)
+        self.phase = phase
+
+    @property
+    def ready(self):
+        return self.phase == 'ready'
+
+    def to_dict(self):
+        return {
+            'phase': self.phase,
+            'ready': self.ready,
+            'uptime': round(time.time() - self.started, 3),
+            'phases': dict(self.timings),
+            'backfill': self.backfill.progress() if self.backfill else None
+        }
+
+
+status = RunnerStatus()
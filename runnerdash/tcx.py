@@ -1,11 +1,259 @@
 # -*- coding: utf-8 -*-
-import os
+import io
+import gzip
+import time
+from collections import namedtuple
 
-from lxml import objectify
-from tcxparser import TCXParser, namespace
+from lxml import etree
 
+from .series import to_samples
+
+NAMESPACE = 'http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2'
+GZIP_MAGIC = b'\x1f\x8b'
+
+Activity = namedtuple('Activity', ['start_date', 'summary', 'samples'])
+TrackPoint = namedtuple(
+    'TrackPoint', ['altitude', 'distance', 'latitude', 'longitude', 'timestamp', 'heart_rate'], defaults=(None, )
+)
+
+
+def _tag(name):
+    return '{{{}}}{}'.format(NAMESPACE, name)
+
+
+class RunnerTCXError(Exception):
+    pass
+
+
+class _PrefixedStream(object):
+    # gives back the bytes consumed while sniffing the compression of a stream that cannot seek
+
+    def __init__(self, head, stream):
+        self.head = head
+        self.stream = stream
+
+    def read(self, size=-1):
+        if not self.head:
+            return self.stream.read(size)
+        if size is None or size < 0:
+            data, self.head = self.head + self.stream.read(), b''
+        else:
+            data, self.head = self.head[:size], self.head[size:]
+        return data
+
+
+def _open_stream(stream):
+    head = stream.read(len(GZIP_MAGIC))
+    stream = _PrefixedStream(head, stream)
+    if head == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    return stream
+
+
+class RunnerTCX(object):
+    ACTIVITY = _tag('Activity')
+    ID = _tag('Id')
+    LAP = _tag('Lap')
+    TOTAL_TIME = _tag('TotalTimeSeconds')
+    CALORIES = _tag('Calories')
+    TRACKPOINT = _tag('Trackpoint')
+    TIME = _tag('Time')
+    POSITION = _tag('Position')
+    LATITUDE = _tag('LatitudeDegrees')
+    LONGITUDE = _tag('LongitudeDegrees')
+    ALTITUDE = _tag('AltitudeMeters')
+    DISTANCE = _tag('DistanceMeters')
+    HEART_RATE = _tag('HeartRateBpm')
+    VALUE = _tag('Value')
+    CREATOR = _tag('Creator')
+    NAME = _tag('Name')
+
+    def __init__(self, source):
+        # a file path, the raw document as bytes or any object with a read() method, optionally gzip compressed
+        self.source = source
+        self.name = source if isinstance(source, str) else '<{}>'.format(type(source).__name__)
+        self.start_date = None
+        self.activity_type = None
+        self.creator = None
+        self.duration = 0
+        self.calories = 0
+        self.distance = 0.0
+        self.completed_at = None
+        self.latitude = None
+        self.longitude = None
+        self.altitude_min = None
+        self.altitude_max = None
+        self.altitude_avg = None
+        self.ascent = 0.0
+        self.descent = 0.0
+        self.hr_values = []
+        self._parsed = False
+
+    def _open(self):
+        if isinstance(self.source, (bytes, bytearray, memoryview)):
+            return _open_stream(io.BytesIO(self.source))
+        if isinstance(self.source, str):
+            with open(self.source, 'rb') as fd:
+                compressed = fd.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+            return gzip.open(self.source, 'rb') if compressed else self.source
+        return _open_stream(self.source)
+
+    def _events(self):
+        tags = (
+            self.ACTIVITY, self.ID, self.LAP, self.TOTAL_TIME, self.CALORIES, self.TRACKPOINT, self.CREATOR, self.NAME
+        )
+        source = self._open()
+        try:
+            for event in etree.iterparse(source, events=('start', 'end'), tag=tags, remove_blank_text=True):
+                yield event
+        finally:
+            if isinstance(source, gzip.GzipFile):
+                source.close()
+
+    @staticmethod
+    def _release(elem):
+        # drop the element and every already processed sibling so the tree never grows past the current lap
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+    def _read_trackpoint(self, elem):
+        point = {
+            'time': None,
+            'latitude': None,
+            'longitude': None,
+            'altitude': None,
+            'distance': None,
+            'heart_rate': None
+        }
+        for child in elem:
+            if child.tag == self.TIME:
+                point['time'] = child.text
+            elif child.tag == self.POSITION:
+                for coordinate in child:
+                    if coordinate.tag == self.LATITUDE:
+                        point['latitude'] = float(coordinate.text)
+                    elif coordinate.tag == self.LONGITUDE:
+                        point['longitude'] = float(coordinate.text)
+            elif child.tag == self.ALTITUDE:
+                point['altitude'] = float(child.text)
+            elif child.tag == self.DISTANCE:
+                point['distance'] = float(child.text)
+            elif child.tag == self.HEART_RATE:
+                for value in child.iter(self.VALUE):
+                    point['heart_rate'] = int(value.text)
+                    self.hr_values.append(point['heart_rate'])
+        return point
+
+    def _iter_trackpoints(self):
+        altitude_sum = 0.0
+        altitude_count = 0
+        previous_altitude = None
+        for event, elem in self._events():
+            if event == 'start':
+                if elem.tag == self.ACTIVITY:
+                    self.activity_type = elem.get('Sport', '').lower()
+                continue
+            if elem.tag == self.ID:
+                self.start_date = elem.text
+            elif elem.tag == self.TOTAL_TIME and elem.getparent().tag == self.LAP:
+                self.duration += float(elem.text)
+            elif elem.tag == self.CALORIES and elem.getparent().tag == self.LAP:
+                self.calories += int(elem.text)
+            elif elem.tag == self.NAME and elem.getparent().tag == self.CREATOR:
+                self.creator = elem.text
+            elif elem.tag == self.TRACKPOINT:
+                point = self._read_trackpoint(elem)
+                self._release(elem)
+                if point['time'] is not None:
+                    self.completed_at = point['time']
+                if point['distance'] is not None:
+                    self.distance = point['distance']
+                altitude = point['altitude']
+                if altitude is not None:
+                    altitude_sum += altitude
+                    altitude_count += 1
+                    if self.altitude_min is None or altitude < self.altitude_min:
+                        self.altitude_min = altitude
+                    if self.altitude_max is None or altitude > self.altitude_max:
+                        self.altitude_max = altitude
+                    if previous_altitude is not None:
+                        if altitude > previous_altitude:
+                            self.ascent += altitude - previous_altitude
+                        else:
+                            self.descent += previous_altitude - altitude
+                    previous_altitude = altitude
+                if point['latitude'] is None or point['longitude'] is None or point['distance'] is None:
+                    continue
+                if self.latitude is None:
+                    self.latitude, self.longitude = point['latitude'], point['longitude']
+                yield TrackPoint(
+                    altitude, point['distance'], point['latitude'], point['longitude'], point['time'],
+                    point['heart_rate']
+                )
+            elif elem.tag == self.LAP:
+                self._release(elem)
+        if self.start_date is None:
+            raise RunnerTCXError("no activity found in {}".format(self.name))
+        if altitude_count:
+            self.altitude_avg = altitude_sum / altitude_count
+        self._parsed = True
 
-class RunnerTCX(TCXParser):
     @property
     def trackpoints(self):
-        return self.root.xpath('//ns:Trackpoint', namespaces={'ns': namespace})
+        return self._iter_trackpoints()
+
+    @property
+    def pace(self):
+        secs_per_km = self.duration / (self.distance / 1000) if self.distance else 0
+        return time.strftime("%M:%S", time.gmtime(secs_per_km))
+
+    def summary(self):
+        if not self._parsed:
+            for _ in self.trackpoints:
+                pass
+        summary = {
+            'activity': self.start_date,
+            'activity_type': self.activity_type,
+            'altitude_avg': self.altitude_avg,
+            'altitude_max': self.altitude_max,
+            'altitude_min': self.altitude_min,
+            'altitude_units': 'meters',
+            'ascent': self.ascent,
+            'ascent_units': 'meters',
+            'calories': self.calories,
+            'completed_at': self.completed_at,
+            'descent': self.descent,
+            'descent_units': 'meters',
+            'distance': self.distance,
+            'distance_units': 'meters',
+            'duration': self.duration,
+            'duration_units': 'seconds',
+            'heart_rate_avg': -1,
+            'heart_rate_max': -1,
+            'heart_rate_min': -1,
+            'creator': self.creator,
+            'pace': self.pace,
+            'pace_hours': sum(int(x) * 60**i for i, x in enumerate(reversed(self.pace.split(":")))) / 60 / 60,
+            'pace_units': 'mm:ss/km',
+            'started_at': self.start_date,
+            'start_latitude': self.latitude,
+            'start_longitude': self.longitude
+        }
+        if self.hr_values:
+            summary.update({
+                'heart_rate_avg': sum(self.hr_values) / len(self.hr_values),
+                'heart_rate_max': max(self.hr_values),
+                'heart_rate_min': min(self.hr_values),
+            })
+        return summary
+
+    def to_activity(self):
+        # a single pass over the document: the compact records are collected while the summary is accumulated
+        samples = to_samples(list(self.trackpoints))
+        return Activity(self.start_date, self.summary(), samples)
+
+
+def read_activity(source):
+    # module level so it can be shipped to worker processes, returns plain picklable data only
+    return RunnerTCX(source).to_activity()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import uuid
+import queue
+import shutil
+import logging
+import threading
+
+from .db import RunnerDB
+from .ingest import timed_read_activity
+from .metrics import metrics
+from .utils import make_dirs
+from .config import cfg
+
+log = logging.getLogger(__name__)
+
+
+class RunnerUploadQueue(object):
+    SPOOL_DIR = 'spool'
+    SOURCE = 'upload'
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self):
+        self.spool_path = None
+        self.queue = queue.Queue()
+        self.queued = set()
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.workers = []
+        self.poller = None
+
+    def _job_path(self, job_id, suffix='.tcx'):
+        return os.path.join(self.spool_path, job_id + suffix)
+
+    def _process(self, job_id):
+        db = RunnerDB(cfg.db_file)
+        try:
+            self._ingest(db, job_id)
+        finally:
+            db.release()
+
+    def _ingest(self, db, job_id):
+        path = self._job_path(job_id)
+        db.update_upload_job(job_id, state='running')
+        stage = 'parse'
+        try:
+            activity, seconds = timed_read_activity(path)
+            metrics.parsed(self.SOURCE, activity, seconds)
+            stage, started = 'write', time.perf_counter()
+            imported = db._load_activity(activity)
+            metrics.written(self.SOURCE, imported, time.perf_counter() - started)
+            activity_id = imported or db.find_activity_by_date(activity.start_date).get('id')
+        except Exception as e:
+            metrics.failed(self.SOURCE, stage)
+            log.exception("unable to ingest uploaded activity, job: %s", job_id)
+            os.replace(path, self._job_path(job_id, '.failed'))
+            db.update_upload_job(job_id, state='failed', error=str(e))
+        else:
+            os.remove(path)
+            db.update_upload_job(job_id, state='done', activity_id=activity_id)
+            log.info("uploaded activity ingested, job: %s, activity: %s", job_id, activity_id)
+
+    def _enqueue(self, job_id):
+        with self.lock:
+            if job_id in self.queued:
+                return
+            self.queued.add(job_id)
+        self.queue.put(job_id)
+
+    def _work(self):
+        while True:
+            job_id = self.queue.get()
+            if job_id is None:
+                break
+            try:
+                self._process(job_id)
+            except Exception:
+                # bookkeeping errors such as a locked db, a job still spooled as queued is picked up again by the poll
+                log.exception("unable to process upload job %s", job_id)
+            finally:
+                with self.lock:
+                    self.queued.discard(job_id)
+
+    def _poll(self):
+        # uploads accepted by other worker processes are only spooled there, they are ingested here
+        while not self.stopping.wait(cfg.upload_poll):
+            db = RunnerDB(cfg.db_file)
+            try:
+                for name in os.listdir(self.spool_path):
+                    job_id = name[:-len('.tcx')]
+                    if name.endswith('.tcx') and job_id not in self.queued:
+                        job = db.find_upload_job(job_id)
+                        if job and job.get('state') == 'queued':
+                            self._enqueue(job_id)
+            except Exception:
+                log.exception("unable to poll the upload spool %s", self.spool_path)
+            finally:
+                db.release()
+
+    def submit(self, stream):
+        # the body is copied in chunks as received, gzip uploads stay compressed and are inflated by the parser
+        job_id = uuid.uuid4().hex
+        part = self._job_path(job_id, '.part')
+        with open(part, 'wb') as fd:
+            shutil.copyfileobj(stream, fd, self.CHUNK_SIZE)
+            fd.flush()
+            os.fsync(fd.fileno())
+            size = fd.tell()
+        os.replace(part, self._job_path(job_id))
+        RunnerDB(cfg.db_file).create_upload_job(job_id)
+        # without local workers the upload is picked up from the spool by the process running the services
+        if self.workers:
+            self._enqueue(job_id)
+        log.debug("queued uploaded activity, job: %s, size: %d", job_id, size)
+        return job_id
+
+    def _recover(self):
+        # uploads accepted before a restart are still in the spool, queue them again
+        db = RunnerDB(cfg.db_file)
+        for name in sorted(os.listdir(self.spool_path)):
+            if name.endswith('.tcx'):
+                job_id = name[:-len('.tcx')]
+                if not db.find_upload_job(job_id):
+                    db.create_upload_job(job_id)
+                db.update_upload_job(job_id, state='queued')
+                self._enqueue(job_id)
+                log.info("recovered spooled upload, job: %s", job_id)
+
+    def spool(self):
+        self.spool_path = os.path.join(cfg.base_path, self.SPOOL_DIR)
+        make_dirs(self.spool_path)
+
+    def start(self, workers=None):
+        self.spool()
+        self._recover()
+        self.stopping.clear()
+        for _ in range(workers or cfg.upload_workers):
+            worker = threading.Thread(target=self._work, name='upload-worker', daemon=True)
+            worker.start()
+            self.workers.append(worker)
+        self.poller = threading.Thread(target=self._poll, name='upload-poll', daemon=True)
+        self.poller.start()
+        log.info("started upload queue, spool: %s, workers: %d", self.spool_path, len(self.workers))
+
+    def stop(self):
+        self.stopping.set()
+        self.poller.join()
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+        log.info("stopped upload queue, spool: %s", self.spool_path)
+
+
+upload_queue = RunnerUploadQueue()
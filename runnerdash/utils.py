@@ -20,6 +20,14 @@ def handle_base_path():
     return base_path
 
 
+def format_duration(start, end):
+    duration = (end - start).total_seconds()
+    if duration < 60:
+        return '{} sec'.format(duration)
+    else:
+        return '{0:.0f} min {1:.0f} sec'.format((duration % 3600) // 60, duration % 60)
+
+
 def setup_logging(debug, console, base_path):
     level = logging.DEBUG if debug else logging.INFO
     if not console:
@@ -1,17 +1,18 @@
 # -*- coding: utf-8 -*-
-import math
 import logging
 
-import numpy
-import arrow
 from passlib.hash import pbkdf2_sha256
 from flask.views import View, MethodView
-from flask import render_template, request, redirect, url_for, jsonify, current_app
+from flask import Response, render_template, request, redirect, url_for, jsonify, current_app, abort
 from flask_googlemaps import GoogleMaps
 from flask_login import login_required, login_user, logout_user
 
-from .login import User, apikey_required
+from .login import User, apikey_required, login_or_apikey_required
 from .calculator import RunnerCalculator
+from .upload import upload_queue
+from .status import status
+from .responses import cached_response, streamed_json
+from .metrics import metrics
 
 log = logging.getLogger(__name__)
 
@@ -41,65 +42,46 @@ class LogoutView(View, RunnerCalculator):
 
 
 class IndexView(View, RunnerCalculator):
-    decorators = [login_required]
+    decorators = [cached_response, login_required]
 
     def dispatch_request(self):
         if self.db.is_first_run():
             return redirect(url_for('wizard_view'), code=302)
         else:
+            before = request.args.get('before')
+            activities = self._activity_table(before)
+            older = activities[-1].get('started_at') if len(activities) == self.PAGE_SIZE else None
             return render_template(
-                'index.html', activities=self._activity_table(), fullmap=self._get_random_activity_map()
+                'index.html',
+                activities=activities,
+                before=before,
+                older=older,
+                fullmap=self._get_random_activity_map()
             )
 
 
 class DashboardView(MethodView, RunnerCalculator):
-    decorators = [login_required]
+    decorators = [cached_response, login_required]
 
-    def post(self):
-        activity_id = request.form['activity-id']
-
-        trackpoints = list(self.db.track_points.find(activity_id=activity_id))
-        path = self._get_path(trackpoints)
+    def get(self):
+        return self._render(request.args['activity-id'])
 
-        start_point = path[0]
-        middle_point = path[len(path) // 2]
-        end_point = path[-1]
+    def post(self):
+        return self._render(request.form['activity-id'])
 
-        markers = [
-            {
-                'color': 'green',
-                'lat': start_point['lat'],
-                'lng': start_point['lng'],
-                'label': 'Start!'
-            }, {
-                'color': 'red',
-                'lat': end_point['lat'],
-                'lng': end_point['lng'],
-                'label': 'End!'
-            }
-        ]
-
-        trackmap = self.gmap.render(
-            'trackmap',
-            middle_point['lat'],
-            middle_point['lng'],
-            path=path,
-            markers=markers,
-            zoom=15,
-            height="400px",
-            position="relative",
-            zindex=200
+    def _render(self, activity_id):
+        trackmap = self._render_path_map(
+            'trackmap', activity_id, self.TRACKMAP_ZOOM, height="400px", position="relative", zindex=200
         )
 
-        distances = numpy.diff([x.get('distance') for x in trackpoints])[::self.GRANULARITY]
-        times = numpy.diff([arrow.get(x.get('timestamp')) for x in trackpoints])[::self.GRANULARITY]
-        speeds = [
-            '{0:.1f}'.format(x) for x in [x / y.total_seconds() * 3.6
-                                          for x, y in zip(distances, times)] if not math.isnan(x)
-        ]
-        timestamps = [arrow.get(x.get('timestamp')).format("HH:mm") for x in trackpoints][::self.GRANULARITY]
-
-        return render_template('dashboard.html', trackmap=trackmap, speeds=speeds, timestamps=timestamps)
+        # the speed chart is fetched from the data api once the page is shown
+        return render_template(
+            'dashboard.html',
+            trackmap=trackmap,
+            speed_url=url_for('api_activity_series_view', activity_id=activity_id, series='speed'),
+            analysis=self._activity_analysis(activity_id),
+            heart_rate=self._activity_heart_rate(activity_id)
+        )
 
 
 class WizardView(MethodView, RunnerCalculator):
@@ -126,7 +108,7 @@ class WizardView(MethodView, RunnerCalculator):
 
 
 class SettingsView(MethodView, RunnerCalculator):
-    decorators = [login_required]
+    decorators = [cached_response, login_required]
 
     def get(self):
         settings = self.db._get_settings()
@@ -154,12 +136,88 @@ class APIView(MethodView, RunnerCalculator):
     decorators = [apikey_required]
 
     def post(self):
-        self.db.load_activity_xml(request.data)
-        return jsonify("success")
+        job_id = upload_queue.submit(request.stream)
+        return jsonify({'job': job_id, 'status': url_for('api_job_view', job_id=job_id)}), 202
+
+
+class APIJobView(MethodView, RunnerCalculator):
+    decorators = [apikey_required]
+
+    def get(self, job_id):
+        job = self.db.find_upload_job(job_id)
+        if not job:
+            abort(404)
+        return jsonify(
+            {
+                'job': job.get('job'),
+                'state': job.get('state'),
+                'activity_id': job.get('activity_id'),
+                'error': job.get('error'),
+                'created_at': job.get('created_at'),
+                'updated_at': job.get('updated_at')
+            }
+        )
+
+
+class APIActivitiesView(MethodView, RunnerCalculator):
+    decorators = [cached_response, login_or_apikey_required]
+    MAX_LIMIT = 500
+
+    def get(self):
+        before = request.args.get('before')
+        limit = max(1, min(request.args.get('limit', self.PAGE_SIZE, type=int), self.MAX_LIMIT))
+        activities = self._activity_list(before, limit)
+        older = activities[-1].get('started_at') if len(activities) == limit else None
+        data = {
+            'activities': activities,
+            'next': url_for('api_activities_view', before=older, limit=limit) if older else None
+        }
+        return streamed_json(data)
+
+
+class APIActivitySeriesView(MethodView, RunnerCalculator):
+    decorators = [cached_response, login_or_apikey_required]
+    MAX_POINTS = 2000
+    MAX_ZOOM = 21
+    # method, query argument and its bounds per series
+    SERIES = {
+        'path': ('_path_series', 'zoom', 0, MAX_ZOOM),
+        'speed': ('_speed_series', 'points', 1, MAX_POINTS),
+        'heart_rate': ('_heart_rate_series', 'points', 1, MAX_POINTS)
+    }
+
+    def get(self, activity_id, series):
+        if series not in self.SERIES:
+            abort(404)
+        activity = self.db.find_activity_by_id(activity_id)
+        if not activity:
+            abort(404)
+        method, argument, low, high = self.SERIES[series]
+        value = request.args.get(argument, type=int)
+        if value is not None:
+            value = max(low, min(value, high))
+        return streamed_json(getattr(self, method)(activity_id, value))
 
 
 class StatisticsView(View, RunnerCalculator):
-    decorators = [login_required]
+    decorators = [cached_response, login_required]
+
+    def dispatch_request(self):
+        return render_template(
+            'statistics.html',
+            fullmap=self._get_random_activity_map(),
+            statistics=self._statistics(),
+            heart_rate=self._heart_rate_history()
+        )
+
+
+class ReadyView(View):
+    def dispatch_request(self):
+        return jsonify(status.to_dict()), 200 if status.ready else 503
+
+
+class MetricsView(View):
+    decorators = [login_or_apikey_required]
 
     def dispatch_request(self):
-        return render_template('statistics.html', fullmap=self._get_random_activity_map())
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
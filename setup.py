@@ -20,10 +20,16 @@ AUTHOR = 'Matteo Bigoi'
 
 # What packages are required for this module to be executed?
 REQUIRED = [
-    'flask', 'flask-googlemaps', 'flask-login', 'passlib'
-    'dataset', 'numpy', 'pytest', 'watchdog', 'arrow'
+    'flask', 'flask-googlemaps', 'flask-login', 'passlib', 'dataset>=2', 'numpy', 'pytest', 'watchdog', 'arrow',
+    'lxml'
 ]
 
+# What packages are optional?
+EXTRAS = {
+    'brotli': ['brotli'],
+    'production': ['waitress'],
+}
+
 here = os.path.abspath(os.path.dirname(__file__))
 
 # Import the README and use it as the long-description.
@@ -79,9 +85,10 @@ setup(
     author=AUTHOR,
     author_email=EMAIL,
     url=URL,
-    packages=find_packages(exclude=('tests',)),
+    packages=find_packages(exclude=('tests', 'benchmarks')),
     scripts=['bin/dash'],
     install_requires=REQUIRED,
+    extras_require=EXTRAS,
     include_package_data=True,
     license='MIT',
     classifiers=[
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import synthetic_tcx  # noqa
+from runnerdash.app import create_app  # noqa
+from runnerdash.db import RunnerDB  # noqa
+from runnerdash.config import cfg  # noqa
+from runnerdash.upload import upload_queue  # noqa
+
+
+@pytest.fixture
+def client(tmp_path):
+    app = create_app(str(tmp_path), services=False, upload_poll=0.1)
+    db = RunnerDB(cfg.db_file)
+    db.update_settings('runner', '1980-01-01', 'M', 70, '', password='unused')
+    upload_queue.start(workers=1)
+    try:
+        yield app.test_client(), db._get_settings().get('api_key')
+    finally:
+        upload_queue.stop()
+        RunnerDB.dispose()
+
+
+def test_uploaded_job_is_tracked_until_done(client):
+    client, api_key = client
+    tcx = synthetic_tcx(datetime.datetime(2018, 5, 1, 7), 600).encode()
+    response = client.post('/api', data=tcx, headers={'x-api-key': api_key})
+    assert response.status_code == 202
+    status_url = response.get_json()['status']
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        job = client.get(status_url, headers={'x-api-key': api_key})
+        assert job.status_code == 200
+        if job.get_json()['state'] in ('done', 'failed'):
+            break
+        time.sleep(0.1)
+    assert job.get_json()['state'] == 'done'
+    assert job.get_json()['activity_id']